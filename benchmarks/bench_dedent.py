@@ -0,0 +1,64 @@
+"""
+Compares removing a snippet's shared indentation with textwrap.dedent,
+as snippets were rendered before, against dedent_lines, checking that
+both give the same output
+
+Run with `python -m benchmarks.bench_dedent`
+"""
+
+import random
+import textwrap
+import timeit
+
+from cogs.utils import dedent_lines
+
+
+def old_format(lines):
+    return textwrap.dedent('\n'.join(lines)).rstrip().replace('`', '`\u200b')
+
+
+def new_format(lines):
+    return dedent_lines(lines).rstrip().replace('`', '`\u200b')
+
+
+def make_lines(count, rng):
+    """Generates indented Python-looking lines, with blank and whitespace-only lines mixed in"""
+
+    words = ['self', 'value', 'return', 'await', 'session', 'file_path', '`code`', 'None', '+=', '1']
+    lines = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.1:
+            lines.append('')
+        elif kind < 0.15:
+            lines.append(rng.choice([' ', '\t', '        ']))
+        else:
+            indent = ' ' * (4 * rng.randrange(1, 5))
+            lines.append(indent + ' '.join(rng.choice(words) for _ in range(rng.randrange(2, 10))))
+    return lines
+
+
+def main():
+    rng = random.Random(0)
+
+    # Random windows, including tabs and odd indentation, must come out the same
+    for _ in range(10000):
+        lines = [
+            ''.join(rng.choice(' \t`x') for _ in range(rng.randrange(8)))
+            for _ in range(rng.randrange(1, 8))
+        ]
+        assert new_format(lines) == old_format(lines), lines
+
+    for count in [1, 20, 50, 200, 1000]:
+        lines = make_lines(count, rng)
+        assert new_format(lines) == old_format(lines)
+
+        number = max(10, 100000 // count)
+        old = min(timeit.repeat(lambda: old_format(lines), number=number, repeat=5)) / number
+        new = min(timeit.repeat(lambda: new_format(lines), number=number, repeat=5)) / number
+        print(f'{count:>5} lines: {old * 1e6:>8.1f}us textwrap.dedent, {new * 1e6:>8.1f}us dedent_lines, '
+              f'{old / new:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Measures how much rendering snippets of large files delays the event
+loop, with renders on the loop and on the render executor
+
+A task standing in for the gateway heartbeat wakes up every few
+milliseconds and records how late it was, which is the delay bot.latency
+would show, while snippets of freshly downloaded large files are rendered
+
+Run with `python -m benchmarks.bench_gateway`
+"""
+
+import argparse
+import asyncio
+import time
+
+from benchmarks.bench_render import make_file
+from cogs import utils
+from cogs.cache import Blob
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def heartbeat(interval, lags, stop):
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - expected)
+
+
+async def run(file_contents, renders, concurrency, interval):
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.ensure_future(heartbeat(interval, lags, stop))
+    semaphore = asyncio.Semaphore(concurrency)
+    lines = file_contents.count('\n')
+
+    async def render(i):
+        async with semaphore:
+            # A new Blob each time, like a file that was just downloaded
+            start_line = lines // renders * i + 1
+            await utils.snippet_to_embed(Blob(file_contents), 'bench.py', start_line, start_line + 20)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(render(i) for i in range(renders)))
+    elapsed = time.perf_counter() - start_time
+
+    stop.set()
+    await beat
+    return elapsed, lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--lines', type=int, default=200000, help='lines in each file')
+    parser.add_argument('--renders', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4, help='renders at once')
+    parser.add_argument('--interval', type=float, default=0.005, help='seconds between heartbeats')
+    args = parser.parse_args()
+
+    file_contents = make_file(args.lines)
+    print(f'{args.renders} renders of a {len(file_contents) / 1024 / 1024:.1f}MiB file')
+
+    loop = asyncio.get_event_loop()
+    for mode, threshold in [('on loop', float('inf')), ('executor', utils.RENDER_EXECUTOR_CHARS)]:
+        utils.RENDER_EXECUTOR_CHARS = threshold
+        utils.render_cache.clear()
+        elapsed, lags = loop.run_until_complete(run(file_contents, args.renders, args.concurrency, args.interval))
+        print(f'{mode:>9}: {elapsed:.2f}s, heartbeat lag p50 {percentile(lags, 0.5) * 1000:.1f}ms, '
+              f'p99 {percentile(lags, 0.99) * 1000:.1f}ms, max {max(lags) * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
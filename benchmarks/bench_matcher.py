@@ -0,0 +1,80 @@
+"""
+Compares matching links with one regex per provider against LinkMatcher
+
+Run with `python -m benchmarks.bench_matcher`
+"""
+
+import random
+import timeit
+
+from cogs.code_snippets import (BITBUCKET_RE, GITHUB_GIST_RE, GITHUB_RE, GITLAB_RE, HEPTAPOD_RE,
+                                CodeSnippets)
+
+CHATTER = [
+    'hey does anyone know why my bot is not responding',
+    'lol',
+    'I tried that but it still throws a KeyError on line 12',
+    'can you paste the full traceback?',
+    'check out https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+    'the docs are at https://discordpy.readthedocs.io/en/latest/api.html',
+    'thanks, that fixed it :)',
+    'you need to await the coroutine, otherwise nothing happens ' * 3,
+    'https://stackoverflow.com/questions/39663071/what-is-the-difference-between-async-and-await',
+    'ok',
+]
+
+LINKS = [
+    'https://github.com/dolphingarlic/git-the-lines/blob/master/bot.py#L1-L2',
+    'https://gist.github.com/dolphingarlic/9881f9bdd40d342338b2dc5d794f12d6#file-funkyname-test-cpp-L1-L3',
+    'https://gitlab.com/dolphingarlic/bot-testing/-/blob/master/nested/file.py#L1-2',
+    'https://bitbucket.org/avdg/ai-bot-js/src/197308c293b64151ef6ac1b7238051ed415a181b/MyBot.js#lines-1:2',
+    'https://foss.heptapod.net/pypy/pypy/-/blob/branch/py3.7/include/PyPy.h#L1-2',
+]
+
+
+def make_corpus(size=10000, link_ratio=0.02, seed=0):
+    """Generates chat messages where link_ratio of them contain a snippet link"""
+
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        message = rng.choice(CHATTER)
+        if rng.random() < link_ratio:
+            message = f'{message} {rng.choice(LINKS)}'
+        corpus.append(message)
+    return corpus
+
+
+def separate_regexes(patterns, corpus):
+    """The old approach: every provider's regex scans every message"""
+
+    count = 0
+    for content in corpus:
+        for pattern in patterns:
+            for _ in pattern.finditer(content):
+                count += 1
+    return count
+
+
+def link_matcher(matcher, corpus):
+    count = 0
+    for content in corpus:
+        for _ in matcher.finditer(content):
+            count += 1
+    return count
+
+
+def main():
+    matcher = CodeSnippets(None, None).matcher
+    patterns = [GITHUB_RE, GITHUB_GIST_RE, GITLAB_RE, BITBUCKET_RE, HEPTAPOD_RE]
+    corpus = make_corpus()
+
+    assert separate_regexes(patterns, corpus) == link_matcher(matcher, corpus)
+
+    for name, func, arg in [('separate regexes', separate_regexes, patterns), ('LinkMatcher', link_matcher, matcher)]:
+        best = min(timeit.repeat(lambda: func(arg, corpus), number=5, repeat=5)) / 5
+        print(f'{name:>16}: {len(corpus) / best:>12,.0f} messages/sec')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Measures the cost of rendering a snippet from a str, from a Blob whose
+line index has already been built, and from the render cache
+
+Run with `python -m benchmarks.bench_render`
+"""
+
+import asyncio
+import random
+import timeit
+
+from cogs.cache import Blob
+from cogs.utils import render_cache, render_snippet, snippet_to_embed
+
+
+def make_file(lines, seed=0):
+    """Generates Python-looking source with the given number of lines"""
+
+    rng = random.Random(seed)
+    words = ['self', 'value', 'return', 'await', 'session', 'file_path', '`code`', 'None', '+=', '1']
+    return '\n'.join(
+        ' ' * (4 * rng.randrange(4)) + ' '.join(rng.choice(words) for _ in range(rng.randrange(2, 10)))
+        for _ in range(lines)
+    ) + '\n'
+
+
+def main():
+    loop = asyncio.new_event_loop()
+
+    for lines in [100, 10000, 1000000]:
+        file_contents = make_file(lines)
+        start_line, end_line = str(lines // 2), str(lines // 2 + 20)
+
+        uncached = min(timeit.repeat(
+            lambda: render_snippet(file_contents, 'bench.py', start_line, end_line), number=10, repeat=3)) / 10
+
+        blob = Blob(file_contents)
+        blob.line_starts()
+        indexed = min(timeit.repeat(
+            lambda: render_snippet(blob, 'bench.py', start_line, end_line), number=10, repeat=3)) / 10
+
+        render_cache.clear()
+        loop.run_until_complete(snippet_to_embed(file_contents, 'bench.py', start_line, end_line))
+        cached = min(timeit.repeat(
+            lambda: loop.run_until_complete(snippet_to_embed(file_contents, 'bench.py', start_line, end_line)),
+            number=1000, repeat=3)) / 1000
+
+        print(f'{lines:>8} lines: {uncached * 1e6:>10.1f}us from str, {indexed * 1e6:>6.1f}us indexed, '
+              f'{cached * 1e6:>6.1f}us cached')
+
+    loop.close()
+
+
+if __name__ == '__main__':
+    main()
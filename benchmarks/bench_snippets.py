@@ -0,0 +1,175 @@
+"""
+Drives CodeSnippets.on_message with a synthetic stream of messages against
+the mock providers, and reports throughput, latency percentiles and bytes
+fetched per snippet
+
+Run with `python -m benchmarks.bench_snippets`
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import time
+
+from benchmarks.mock_server import MockProviders, MockSession, start
+from cogs import utils
+from cogs.code_snippets import CodeSnippets
+from cogs.delete_reactions import DeleteReactions
+from cogs.jobs import jobs
+from cogs.session import create_session
+
+REPOS = [f'owner{i}/repo{i}' for i in range(20)]
+FILES = ['bot.py', 'cogs/utils.py', 'cogs/code_snippets.py', 'README.md', 'src/main/App.java']
+REFS = ['master', 'develop', 'feature/x', 'v1.0', '197308c293b64151ef6ac1b7238051ed415a181b']
+
+
+class FakeSentMessage:
+    ids = itertools.count()
+
+    def __init__(self):
+        self.id = next(self.ids)
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def remove_reaction(self, emoji, member):
+        pass
+
+    async def delete(self):
+        pass
+
+
+class FakeChannel:
+    id = 1
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, content=None, embed=None):
+        self.sent += 1
+        return FakeSentMessage()
+
+
+class FakeAuthor:
+    bot = False
+    id = 1
+
+
+class FakeMessage:
+    ids = itertools.count()
+
+    def __init__(self, content, channel):
+        self.id = next(self.ids)
+        self.content = content
+        self.channel = channel
+        self.author = FakeAuthor()
+        self.guild = None
+
+
+class FakeBot:
+    user = None
+
+    def __init__(self):
+        self.cogs = {}
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+
+def make_link(rng, lines):
+    """Makes a random snippet link, favouring a few popular repos the way real traffic does"""
+
+    repo = REPOS[min(int(rng.paretovariate(1.2)) - 1, len(REPOS) - 1)]
+    path = rng.choice(FILES)
+    ref = rng.choice(REFS)
+    start_line = rng.randrange(1, lines)
+    end_line = min(lines, start_line + rng.randrange(0, 15))
+
+    provider = rng.choice(['github', 'gitlab', 'bitbucket', 'heptapod', 'gist'])
+    if provider == 'github':
+        return f'https://github.com/{repo}/blob/{ref}/{path}#L{start_line}-L{end_line}'
+    if provider == 'gitlab':
+        return f'https://gitlab.com/{repo}/-/blob/{ref}/{path}#L{start_line}-{end_line}'
+    if provider == 'bitbucket':
+        return f'https://bitbucket.org/{repo}/src/{REFS[-1]}/{path}#lines-{start_line}:{end_line}'
+    if provider == 'heptapod':
+        return f'https://foss.heptapod.net/{repo}/-/blob/branch/{REFS[0]}/{path}#L{start_line}-{end_line}'
+    gist_id = f'{REPOS.index(repo):032x}'
+    return f'https://gist.github.com/user/{gist_id}#file-test-py-L{start_line}-L{end_line}'
+
+
+def make_messages(count, links_per_message, lines, seed=0):
+    rng = random.Random(seed)
+    return [
+        ' and '.join(make_link(rng, lines) for _ in range(rng.randint(1, links_per_message)))
+        for _ in range(count)
+    ]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def run(args):
+    """Runs the benchmark, printing its results and returning the counts they're made from"""
+
+    providers = MockProviders(args.latency, args.lines, args.rate_limit)
+    runner = await start(providers, port=args.port)
+
+    try:
+        async with create_session() as http:
+            bot = FakeBot()
+            bot.cogs['DeleteReactions'] = delete_reactions = DeleteReactions(bot)
+            cog = CodeSnippets(bot, MockSession(http, f'http://127.0.0.1:{args.port}'))
+            channel = FakeChannel()
+            messages = make_messages(args.messages, args.links_per_message, args.lines)
+            links = sum(message.count('https://') for message in messages)
+
+            semaphore = asyncio.Semaphore(args.concurrency)
+            latencies = []
+
+            async def handle(content):
+                async with semaphore:
+                    start_time = time.perf_counter()
+                    await cog.on_message(FakeMessage(content, channel))
+                    latencies.append(time.perf_counter() - start_time)
+
+            start_time = time.perf_counter()
+            await asyncio.gather(*(handle(content) for content in messages))
+            elapsed = time.perf_counter() - start_time
+            # Nobody reacts, and the benchmark shouldn't wait for the replies to expire
+            delete_reactions.cog_unload()
+            jobs.close()
+    finally:
+        await runner.cleanup()
+
+    print(f'{len(messages)} messages, {links} links in {elapsed:.2f}s')
+    print(f'throughput:       {len(messages) / elapsed:.1f} messages/s')
+    print(f'latency p50:      {percentile(latencies, 0.5) * 1000:.1f}ms')
+    print(f'latency p99:      {percentile(latencies, 0.99) * 1000:.1f}ms')
+    print(f'replies sent:     {channel.sent}')
+    print(f'upstream requests: {providers.stats["requests"]} '
+          f'({providers.stats["not_modified"]} not modified, {providers.stats["rate_limited"]} rate limited)')
+    print(f'bytes per snippet: {providers.stats["bytes"] / links:.0f} served, '
+          f'{utils.transfer_stats["bytes"] / links:.0f} read')
+    return {'messages': len(messages), 'links': links, 'replies': channel.sent, **providers.stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--links-per-message', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=50, help='messages handled at once')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per upstream response')
+    parser.add_argument('--lines', type=int, default=500, help='lines in every file')
+    parser.add_argument('--rate-limit', type=int, default=5000, help='requests per hour per API')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Local stand-in for the GitHub, GitLab, Bitbucket, Heptapod and Gist
+endpoints used in cogs/utils.py
+
+Requests are sent to http://<host>:<port>/<provider host>/<path> by
+MockSession, which rewrites the https URLs the fetch functions build.
+Latency, rate limits and file sizes are configurable so benchmarks are
+reproducible without touching the real APIs
+
+Run on its own with `python -m benchmarks.mock_server`
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import yarl
+from aiohttp import web
+
+BRANCHES = ['master', 'develop', 'feature/x']
+TAGS = ['v1.0']
+
+# Gist files bigger than this have truncated inline content, like the real API
+GIST_INLINE_LIMIT = 1024 * 1024
+
+ROUTES = [
+    ('api.github.com', re.compile(r'repos/(?P<repo>[^/]+/[^/]+)/(?P<kind>branches|tags)'), 'refs'),
+    ('api.github.com', re.compile(r'repos/(?P<repo>[^/]+/[^/]+)/contents/(?P<path>.+)'), 'github_file'),
+    ('api.github.com', re.compile(r'gists/(?P<gist_id>[^/]+)(/(?P<revision>[^/]+))?'), 'gist'),
+    ('gitlab.com', re.compile(r'api/v4/projects/(?P<repo>[^/]+)/repository/(?P<kind>branches|tags)'), 'refs'),
+    ('gitlab.com', re.compile(r'api/v4/projects/(?P<repo>[^/]+)/repository/files/(?P<path>[^/]+)/raw'), 'gitlab_file'),
+    # fetch_bitbucket_snippet quotes the repo's slash as %2F
+    ('bitbucket.org', re.compile(r'(?P<repo>[^/]+(?:/|%2F)[^/]+)/raw/(?P<ref>[^/]+)/(?P<path>.+)'), 'raw_file'),
+    ('foss.heptapod.net', re.compile(r'(?P<repo>[^/]+/[^/]+)/-/raw/branch/(?P<ref>[^/]+)/(?P<path>.+)'), 'raw_file'),
+    ('gist.githubusercontent.com', re.compile(r'(?P<user>[^/]+)/(?P<gist_id>[^/]+)/raw/(?P<revision>[^/]*)/(?P<path>.+)'),
+     'raw_file'),
+]
+
+RATE_LIMITED_HOSTS = {'api.github.com', 'gitlab.com'}
+
+
+def make_file(path, lines):
+    """Generates the contents of a file, the same every time for the same path"""
+
+    seed = int(hashlib.sha1(path.encode()).hexdigest()[:8], 16)
+    return ''.join(
+        f'{" " * (4 * ((seed + i) % 3))}value_{i} = compute({(seed * i) % 1000})  # `{path}`\n'
+        for i in range(lines)
+    ).encode()
+
+
+class MockProviders:
+    def __init__(self, latency=0.05, file_lines=500, rate_limit=5000, rate_limit_window=3600):
+        """
+        latency is in seconds per response, file_lines is the number of
+        lines in every file, and rate_limit is the number of requests each
+        rate limited host allows per rate_limit_window seconds
+        """
+
+        self.latency = latency
+        self.file_lines = file_lines
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+
+        self.files = {}
+        self.windows = {}
+        # Real servers only answer a Range request with If-Range if the file hasn't changed
+        self.if_range = True
+        self.stats = {'requests': 0, 'not_modified': 0, 'rate_limited': 0, 'bytes': 0}
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', self.handle)
+        return app
+
+    def file(self, path):
+        if path not in self.files:
+            self.files[path] = make_file(path, self.file_lines)
+        return self.files[path]
+
+    def rate_limit_headers(self, host):
+        """Counts a request against host's quota, returning the headers the real API would send"""
+
+        now = time.time()
+        start, used = self.windows.get(host, (now, 0))
+        if now - start >= self.rate_limit_window:
+            start, used = now, 0
+        used += 1
+        self.windows[host] = (start, used)
+
+        prefix = 'X-RateLimit' if host == 'api.github.com' else 'RateLimit'
+        return {
+            f'{prefix}-Limit': str(self.rate_limit),
+            f'{prefix}-Remaining': str(max(0, self.rate_limit - used)),
+            f'{prefix}-Reset': str(int(start + self.rate_limit_window)),
+        }, used > self.rate_limit
+
+    async def handle(self, request):
+        self.stats['requests'] += 1
+        await asyncio.sleep(self.latency)
+
+        raw_path = request.raw_path.split('?', 1)[0].lstrip('/')
+        host, _, rest = raw_path.partition('/')
+        query = {key: values[0] for key, values in parse_qs(request.query_string).items()}
+
+        for route_host, pattern, kind in ROUTES:
+            match = pattern.fullmatch(rest)
+            if route_host == host and match is not None:
+                break
+        else:
+            return web.Response(status=404, text='{"message": "Not Found"}')
+
+        headers = {}
+        if host in RATE_LIMITED_HOSTS:
+            headers, exhausted = self.rate_limit_headers(host)
+            if exhausted:
+                self.stats['rate_limited'] += 1
+                return web.Response(status=403, headers=headers, text='{"message": "API rate limit exceeded"}')
+
+        groups = {key: unquote(value) for key, value in match.groupdict().items() if value is not None}
+        if kind == 'refs':
+            names = BRANCHES if groups['kind'] == 'branches' else TAGS
+            return web.json_response([{'name': name} for name in names], headers=headers)
+        if kind == 'gist':
+            return self.gist(request, groups, headers)
+
+        ref = groups.get('ref', query.get('ref'))
+        if ref is not None and ref not in BRANCHES + TAGS and not re.fullmatch(r'[0-9a-f]{40}', ref):
+            return web.Response(status=404, headers=headers, text='{"message": "No commit found for the ref"}')
+        return self.body(request, self.file(groups['path']), headers, ranged=kind == 'raw_file')
+
+    def gist(self, request, groups, headers):
+        revision = groups.get('revision', 'a' * 40)
+        name = 'test.py'
+        contents = self.file(f'{groups["gist_id"]}/{name}')
+        truncated = len(contents) > GIST_INLINE_LIMIT
+        gist_json = {
+            'files': {
+                name: {
+                    'filename': name,
+                    'raw_url': f'https://gist.githubusercontent.com/user/{groups["gist_id"]}/raw/{revision}/{name}',
+                    'size': len(contents),
+                    'truncated': truncated,
+                    'content': contents[:GIST_INLINE_LIMIT].decode(),
+                },
+            },
+        }
+        return self.body(request, json.dumps(gist_json).encode(), headers, content_type='application/json')
+
+    def body(self, request, body, headers, ranged=False, content_type='text/plain'):
+        """Responds with body, honouring If-None-Match and (if ranged) Range and If-Range"""
+
+        etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+        headers = dict(headers, ETag=etag)
+        headers['Content-Type'] = f'{content_type}; charset=utf-8'
+
+        if request.headers.get('If-None-Match') == etag:
+            self.stats['not_modified'] += 1
+            return web.Response(status=304, headers=headers)
+
+        range_match = re.fullmatch(r'bytes=(\d+)-(\d*)', request.headers.get('Range', ''))
+        if_range = request.headers.get('If-Range')
+        if self.if_range and if_range is not None and if_range != etag:
+            # Changed since the client's earlier ranges, so it gets the whole file
+            range_match = None
+        if ranged and range_match is not None:
+            start = int(range_match.group(1))
+            end = int(range_match.group(2)) if range_match.group(2) else len(body) - 1
+            if start >= len(body):
+                headers['Content-Range'] = f'bytes */{len(body)}'
+                return web.Response(status=416, headers=headers)
+            chunk = body[start:end + 1]
+            headers['Content-Range'] = f'bytes {start}-{start + len(chunk) - 1}/{len(body)}'
+            self.stats['bytes'] += len(chunk)
+            return web.Response(status=206, body=chunk, headers=headers)
+
+        self.stats['bytes'] += len(body)
+        return web.Response(body=body, headers=headers)
+
+
+class MockSession:
+    """Wraps an aiohttp session, sending requests for https URLs to the mock server instead"""
+
+    def __init__(self, session, base_url):
+        self.session = session
+        self.base_url = base_url.rstrip('/')
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def get(self, url, **kwargs):
+        parts = urlsplit(url)
+        mock_url = f'{self.base_url}/{parts.netloc}{parts.path}'
+        if parts.query:
+            mock_url += f'?{parts.query}'
+        # encoded=True keeps GitLab's %2F-encoded project and file paths intact
+        return self.session.get(yarl.URL(mock_url, encoded=True), **kwargs)
+
+
+async def start(providers, host='127.0.0.1', port=8765):
+    """Starts serving the mock providers, returning the runner to clean up with"""
+
+    runner = web.AppRunner(providers.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per response')
+    parser.add_argument('--lines', type=int, default=500, help='lines in every file')
+    parser.add_argument('--rate-limit', type=int, default=5000, help='requests per hour per API')
+    args = parser.parse_args()
+
+    providers = MockProviders(args.latency, args.lines, args.rate_limit)
+    web.run_app(providers.app(), host='127.0.0.1', port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,18 +8,22 @@ when a GitHub or GitLab link is sent
 import asyncio
 import os
 import logging
-
-import aiohttp
+from functools import partial
 
 from discord import Activity, ActivityType
-from discord.ext.commands import Bot, when_mentioned_or
+from discord.ext.commands import AutoShardedBot, when_mentioned_or
 
 from cogs.bot_info import BotInfo
 from cogs.code_snippets import CodeSnippets
+from cogs.commit_widgets import CommitWidgets
+from cogs.coordinator import sync_budgets
+from cogs.delete_reactions import DeleteReactions
+from cogs.metrics import collector, start_metrics_server
+from cogs.pull_request_widgets import PullRequestWidgets
+from cogs.repo_widgets import RepoWidgets
+from cogs.session import create_session, pool_metrics
 from cogs.top_gg import TopGG
-# from cogs.repo_widgets import RepoWidgets
-# from cogs.commit_widgets import CommitWidgets
-# from cogs.pull_request_widgets import PullRequestWidgets
+from cogs.utils import scheduler, warm_up_cache
 
 
 async def main():
@@ -27,21 +31,46 @@ async def main():
 
     prefix = os.environ.get('BOT_PREFIX', 'g;')
 
-    bot = Bot(
+    # Without SHARD_COUNT, Discord's recommended number of shards is used.
+    # launcher.py sets SHARD_IDS to the comma-separated shards each worker process runs
+    shard_count = int(os.environ['SHARD_COUNT']) if 'SHARD_COUNT' in os.environ else None
+    shard_ids = [int(shard_id) for shard_id in os.environ['SHARD_IDS'].split(',')] if 'SHARD_IDS' in os.environ else None
+
+    bot = AutoShardedBot(
         command_prefix=when_mentioned_or(prefix),
         help_command=None,
         activity=Activity(type=ActivityType.watching, name=f'for snippet links and {prefix}help'),
+        shard_count=shard_count,
+        shard_ids=shard_ids,
     )
 
-    async with aiohttp.ClientSession() as session:
+    worker_id = int(os.environ.get('WORKER_ID', 0))
+
+    async with create_session() as session:
+        await warm_up_cache()
+        collector(partial(pool_metrics, session))
+        if 'METRICS_PORT' in os.environ:
+            await start_metrics_server(int(os.environ['METRICS_PORT']))
+        if 'COORDINATOR_PORT' in os.environ:
+            asyncio.ensure_future(sync_budgets(
+                scheduler,
+                worker_id,
+                port=int(os.environ['COORDINATOR_PORT']),
+                guild_count=lambda: len(bot.guilds) if bot.is_ready() else None,
+            ))
+
         bot.add_cog(BotInfo(bot))
+        bot.add_cog(DeleteReactions(bot))
         bot.add_cog(CodeSnippets(bot, session))
-        # bot.add_cog(RepoWidgets(bot, session))
-        # bot.add_cog(CommitWidgets(bot, session))
-        # bot.add_cog(PullRequestWidgets(bot, session))
+        # Off by default. Their API responses are cached in widget_cache
+        if os.environ.get('ENABLE_WIDGETS') == '1':
+            bot.add_cog(RepoWidgets(bot, session))
+            bot.add_cog(CommitWidgets(bot, session))
+            bot.add_cog(PullRequestWidgets(bot, session))
 
-        if 'TOP_GG_TOKEN' in os.environ:
-            bot.add_cog(TopGG(bot))
+        # Only one worker posts to top.gg, with the guild count over every worker
+        if 'TOP_GG_TOKEN' in os.environ and worker_id == 0:
+            bot.add_cog(TopGG(bot, session))
 
         await bot.start(os.environ['DISCORD_TOKEN'])
 
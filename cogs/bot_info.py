@@ -6,7 +6,11 @@ import os
 from datetime import datetime
 
 import discord
-from discord.ext.commands import Cog, command
+from discord.ext.commands import Cog, command, is_owner
+
+from cogs.metrics import message_seconds, messages_matched, messages_processed
+from cogs.tracing import SAMPLE_RATE, slowest_traces
+from cogs.utils import file_cache
 
 
 class BotInfo(Cog):
@@ -51,6 +55,21 @@ class BotInfo(Cog):
             name='Latency',
             value=f'{round(self.bot.latency * 1000, 2)}ms',
             inline=True
+        ).add_field(
+            name='Snippet Messages',
+            value=f'{messages_matched.total()} of {messages_processed.total()} messages',
+            inline=True
+        ).add_field(
+            name='Cache Hit Ratio',
+            value=f'{round(100 * file_cache.hits / max(1, file_cache.hits + file_cache.misses), 1)}%',
+            inline=True
+        ).add_field(
+            name='Snippet Time (p50 / p99)',
+            value=' / '.join(
+                'n/a' if quantile is None else f'<{quantile}s'
+                for quantile in (message_seconds.quantile(0.5), message_seconds.quantile(0.99))
+            ),
+            inline=True
         ).set_footer(text=f'Made by {info.owner}', icon_url=info.owner.avatar_url)
 
         await ctx.send(embed=embed)
@@ -103,6 +122,24 @@ class BotInfo(Cog):
 
         await ctx.send(f'Pong; {round(self.bot.latency * 1000, 2)}ms')
 
+    @command()
+    @is_owner()
+    async def trace(self, ctx, count: int = 3):
+        """Sends the slowest recently traced messages"""
+
+        if SAMPLE_RATE <= 0:
+            await ctx.send('Tracing is off; set `TRACE_SAMPLE_RATE` to turn it on')
+            return
+
+        traces = slowest_traces(min(count, 10))
+        if not traces:
+            await ctx.send('No messages have been traced yet')
+            return
+
+        # Send each trace separately, trimmed to fit in a message
+        for slow_trace in traces:
+            await ctx.send(f'```\n{slow_trace.format()[:1980]}\n```')
+
     @Cog.listener()
     async def on_guild_join(self, guild):
         """Sends a nice message when added to a new server"""
@@ -0,0 +1,222 @@
+"""
+In-process caches for fetched snippet sources
+
+Entries are evicted least-recently-used first once the total size of the
+cache goes over its byte budget, and expire after a per-entry TTL
+"""
+
+import re
+import time
+from array import array
+from collections import OrderedDict
+from itertools import accumulate, chain, islice
+
+COMMIT_SHA_RE = re.compile(r'^[0-9a-fA-F]{40}$')
+
+# Line indexes are built this many characters at a time
+INDEX_CHUNK = 64 * 1024
+
+
+def is_commit_sha(ref):
+    """Checks if a ref is a full commit SHA, which can never point at different contents"""
+
+    return ref is not None and COMMIT_SHA_RE.match(ref) is not None
+
+
+def sizeof(value):
+    """Approximates the number of bytes a cached value takes up"""
+
+    if isinstance(value, str):
+        return len(value.encode('utf-8', 'surrogatepass'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(str(value))
+
+
+class LRUCache:
+    """Bounded cache with LRU eviction by total bytes and a TTL per entry"""
+
+    def __init__(self, max_bytes, ttl, immutable_ttl=None):
+        """
+        Sets the byte budget and the TTLs (in seconds)
+
+        Entries stored with immutable=True use immutable_ttl instead of ttl
+        """
+
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.immutable_ttl = ttl if immutable_ttl is None else immutable_ttl
+
+        self._entries = OrderedDict()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries and self._entries[key][2] > time.monotonic()
+
+    def get(self, key, default=None):
+        """Returns the value stored under key if it exists and hasn't expired"""
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        value, size, expires = entry
+        if expires <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def lookup(self, key):
+        """
+        Returns the value stored under key and whether it's still fresh
+
+        Unlike get, expired entries are kept so that they can be revalidated
+        """
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+
+        self._entries.move_to_end(key)
+        if entry[2] <= time.monotonic():
+            self.misses += 1
+            return entry[0], False
+        self.hits += 1
+        return entry[0], True
+
+    def set(self, key, value, immutable=False, size=None, ttl=None):
+        """
+        Stores value under key, evicting old entries if over budget
+
+        ttl overrides the cache's TTL for this entry
+        """
+
+        if size is None:
+            size = sizeof(value)
+        if size > self.max_bytes:
+            # Never let a single huge file flush the whole cache
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        if ttl is None:
+            ttl = self.immutable_ttl if immutable else self.ttl
+        self._entries[key] = (value, size, time.monotonic() + ttl)
+        self.total_bytes += size
+
+        while self.total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Removes key from the cache and returns its value"""
+
+        if key not in self._entries:
+            return default
+        value = self._entries[key][0]
+        self._remove(key)
+        return value
+
+    def clear(self):
+        """Empties the cache, keeping the counters"""
+
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        """Returns the cache's counters"""
+
+        return {
+            'entries': len(self._entries),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+
+class Blob:
+    """
+    Cached text of a file, which might only be a prefix of it, along with
+    the ETag and Last-Modified headers it was served with
+    """
+
+    __slots__ = ('text', 'complete', 'lines', 'etag', 'last_modified', 'starts')
+
+    def __init__(self, text, complete=True, etag=None, last_modified=None):
+        self.text = text
+        self.complete = complete
+        self.lines = text.count('\n')
+        self.etag = etag
+        self.last_modified = last_modified
+        # Offset of the start of each line, built the first time a line range is needed
+        self.starts = None
+
+    @property
+    def size(self):
+        """Approximate bytes the blob takes up in a cache, including its line index"""
+
+        return sizeof(self.text) + 4 * (self.lines + 1)
+
+    def has_lines(self, end_line):
+        """Checks if the blob contains every line up to end_line (None meaning the whole file)"""
+
+        return self.complete or (end_line is not None and self.lines >= end_line)
+
+    def line_starts(self):
+        """Returns the offsets in text where each line starts, building them on first use"""
+
+        if self.starts is None:
+            # splitlines() is the fastest way to find every line break it knows about. It's
+            # run a chunk at a time so that, when this runs in a thread, no single call holds
+            # the GIL for long. Chunks end just after a \n, so a \r\n is never split
+            text = self.text
+            starts = array('I', [0])
+            offset = 0
+            while offset < len(text):
+                end = text.find('\n', offset + INDEX_CHUNK) + 1 or len(text)
+                line_ends = accumulate(chain((offset,), map(len, text[offset:end].splitlines(True))))
+                # Skip the chunk's own start, which is already the last offset
+                starts.extend(islice(line_ends, 1, None))
+                offset = end
+            # The last offset is the end of the text, not the start of a line
+            starts.pop()
+            self.starts = starts
+        return self.starts
+
+    def line_count(self):
+        """Returns len(text.splitlines())"""
+
+        return len(self.line_starts())
+
+    def line_range(self, start_line, end_line):
+        """Returns text.splitlines()[start_line - 1:end_line] in O(end_line - start_line)"""
+
+        starts = self.line_starts()
+        start_line = max(1, start_line)
+        end_line = min(len(starts), end_line)
+        if start_line > end_line:
+            return []
+
+        end = starts[end_line] if end_line < len(starts) else len(self.text)
+        return self.text[starts[start_line - 1]:end].splitlines()
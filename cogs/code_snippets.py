@@ -5,10 +5,20 @@ Matches each message against a regex and prints the contents
 of the first matched snippet url
 """
 
+import asyncio
+import logging
+import os
 import re
+import time
 
 from discord.ext.commands import Cog
 
+from cogs.jobs import guild_key, jobs
+from cogs.matcher import LinkMatcher
+from cogs.metrics import (match_seconds, message_seconds, messages_matched, messages_processed, snippet_plans,
+                          snippet_seconds)
+from cogs.ratelimit import RateLimitExceeded
+from cogs.tracing import span, trace
 from cogs.utils import (fetch_bitbucket_snippet, fetch_github_gist_snippet,
                         fetch_github_snippet, fetch_gitlab_snippet, fetch_heptapod_snippet,
                         wait_for_deletion)
@@ -36,9 +46,18 @@ BITBUCKET_RE = re.compile(
 
 HEPTAPOD_RE = re.compile(
     r'https://foss\.heptapod\.net/(?P<repo>[a-zA-Z0-9-]+/[\w.-]+)/-/blob/branch/'
-    r'(?P<path>[^#>]+)(\?[^#>]+)?(#L(?P<start_line>\d+)([-~:](?P<end_line>\d+))?)?'
+    r'(?P<path>[^#>\s]+)(\?[^#>\s]+)?(#L(?P<start_line>\d+)([-~:](?P<end_line>\d+))?)?'
 )
 
+# Discord's limit on message length, and the most lines a reply may have
+MAX_MESSAGE_CHARS = 2000
+MAX_MESSAGE_LINES = 50
+
+# Newlines each snippet adds besides its code: after its header and code fence
+SNIPPET_OVERHEAD_LINES = 2
+
+log = logging.getLogger(__name__)
+
 class CodeSnippets(Cog):
     def __init__(self, bot, session):
         """Initializes the cog's bot"""
@@ -46,13 +65,79 @@ class CodeSnippets(Cog):
         self.bot = bot
         self.session = session
 
-        self.pattern_handlers = [
-            (GITHUB_RE, fetch_github_snippet),
-            (GITHUB_GIST_RE, fetch_github_gist_snippet),
-            (GITLAB_RE, fetch_gitlab_snippet),
-            (BITBUCKET_RE, fetch_bitbucket_snippet),
-            (HEPTAPOD_RE, fetch_heptapod_snippet)
-        ]
+        self.matcher = LinkMatcher([
+            ('https://github.com/', GITHUB_RE, fetch_github_snippet),
+            ('https://gist.github.com/', GITHUB_GIST_RE, fetch_github_gist_snippet),
+            ('https://gitlab.com/', GITLAB_RE, fetch_gitlab_snippet),
+            ('https://bitbucket.org/', BITBUCKET_RE, fetch_bitbucket_snippet),
+            ('https://foss.heptapod.net/', HEPTAPOD_RE, fetch_heptapod_snippet),
+        ])
+
+        # Maximum number of links fetched at once for a single message
+        self.concurrency = int(os.environ.get('SNIPPET_CONCURRENCY', 4))
+
+    async def fetch_snippet(self, semaphore, handler, kwargs, link):
+        """Runs a snippet handler, returning an empty string if it fails"""
+
+        # fetch_github_snippet -> github
+        provider = handler.__name__[len('fetch_'):-len('_snippet')]
+        async with semaphore:
+            try:
+                with span('snippet', provider=provider), snippet_seconds.time(provider=provider):
+                    return await handler(self.session, **kwargs)
+            except RateLimitExceeded as error:
+                log.warning('Shed snippet %s: %s', link, error)
+                return ''
+            except Exception:
+                log.exception('Failed to fetch snippet %s', link)
+                return ''
+
+    def plan_snippets(self, matches):
+        """
+        Fits the linked line ranges into a single message before anything is fetched
+
+        Returns (handler, kwargs, link, whole_file) for each link to fetch.
+        Ranges too long for the lines left are cut short, and links that
+        can't fit at all are skipped. Links to a whole file each ask for all
+        the lines the ranged links leave, since their lengths aren't known
+        yet. send_snippets shares those lines between them once they are
+        """
+
+        matches = list(matches)
+        line_counts = {}
+        lines_left = MAX_MESSAGE_LINES
+        # Ranged links say exactly what they want, so they go first
+        for i, (handler, kwargs, link) in enumerate(matches):
+            if kwargs['start_line'] is None:
+                continue
+
+            window = lines_left - SNIPPET_OVERHEAD_LINES
+            if window < 1:
+                snippet_plans.inc(outcome='skipped')
+                continue
+
+            start_line = int(kwargs['start_line'])
+            end_line = start_line if kwargs['end_line'] is None else int(kwargs['end_line'])
+            start_line, end_line = min(start_line, end_line), max(start_line, end_line)
+            snippet_plans.inc(outcome='full' if end_line - start_line < window else 'truncated')
+            line_counts[i] = (start_line, min(end_line - start_line + 1, window))
+            lines_left -= line_counts[i][1] + SNIPPET_OVERHEAD_LINES
+
+        window = lines_left - SNIPPET_OVERHEAD_LINES
+        for i, (handler, kwargs, link) in enumerate(matches):
+            if kwargs['start_line'] is None:
+                snippet_plans.inc(outcome='skipped' if window < 1 else 'whole_file')
+                if window >= 1:
+                    line_counts[i] = (1, window)
+
+        planned = []
+        for i, (handler, kwargs, link) in enumerate(matches):
+            if i in line_counts:
+                start_line, line_count = line_counts[i]
+                whole_file = kwargs['start_line'] is None
+                kwargs = dict(kwargs, start_line=start_line, end_line=start_line + line_count - 1)
+                planned.append((handler, kwargs, link, whole_file))
+        return planned
 
     @Cog.listener()
     async def on_message(self, message):
@@ -61,13 +146,64 @@ class CodeSnippets(Cog):
         then sends the snippet in Discord
         """
         
-        if not message.author.bot:
-            message_to_send = ''
+        if message.author.bot:
+            return
+
+        messages_processed.inc()
+        if not self.matcher.might_match(message.content):
+            return
+
+        guild_id = None if message.guild is None else message.guild.id
+        with trace('on_message', guild=guild_id, message=message.id):
+            start_time = time.perf_counter()
+            with span('match'), match_seconds.time():
+                planned = self.plan_snippets(self.matcher.finditer(message.content))
+            if not planned:
+                return
+            messages_matched.inc()
+
+            await jobs.run(guild_key(message), lambda: self.send_snippets(message, planned, start_time))
+
+    async def send_snippets(self, message, planned, start_time):
+        """Fetches the planned snippets and replies to message with them"""
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        planned = list(planned)
+        # gather keeps the results in the same order as the links
+        snippets = list(await asyncio.gather(*(
+            self.fetch_snippet(semaphore, handler, kwargs, link) for handler, kwargs, link, _ in planned
+        )))
+
+        # Each snippet's newlines are its code's lines plus SNIPPET_OVERHEAD_LINES
+        lines_left = MAX_MESSAGE_LINES - sum(
+            snippet.count('\n') for (*_, whole_file), snippet in zip(planned, snippets) if not whole_file)
+        # Whole-file links now share the lines the ranged links left, in order. Any
+        # cut short is rendered again from its cached file, which fetches nothing
+        for i, (handler, kwargs, link, whole_file) in enumerate(planned):
+            if not whole_file:
+                continue
+
+            if snippets[i].count('\n') > lines_left:
+                window = lines_left - SNIPPET_OVERHEAD_LINES
+                if window < 1:
+                    snippets[i] = ''
+                    continue
+                planned[i] = (handler, dict(kwargs, end_line=window), link, whole_file)
+                snippets[i] = await self.fetch_snippet(semaphore, handler, planned[i][1], link)
+            lines_left -= snippets[i].count('\n')
 
-            for pattern, handler in self.pattern_handlers:
-                for match in pattern.finditer(message.content):
-                    message_to_send += await handler(self.session, **match.groupdict())
+        message_to_send = ''
+        for (handler, kwargs, link, _), snippet in zip(planned, snippets):
+            if len(message_to_send) + len(snippet) > MAX_MESSAGE_CHARS:
+                # Cut the snippet down to the space left, which doesn't fetch
+                # anything again now that its file is cached
+                kwargs = dict(kwargs, max_chars=MAX_MESSAGE_CHARS - len(message_to_send))
+                message_to_send += await self.fetch_snippet(semaphore, handler, kwargs, link)
+                break
+            message_to_send += snippet
+        message_seconds.observe(time.perf_counter() - start_time)
 
-            if 0 < len(message_to_send) <= 2000 and message_to_send.count('\n') <= 50:
-                # Trim the last \n character and send it to Discord
-                await wait_for_deletion(message, self.bot, message_to_send[:-1])
+        if 0 < len(message_to_send) <= MAX_MESSAGE_CHARS and message_to_send.count('\n') <= MAX_MESSAGE_LINES:
+            # Trim the last \n character and send it to Discord
+            await wait_for_deletion(message, self.bot, message_to_send[:-1])
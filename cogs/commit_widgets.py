@@ -13,7 +13,11 @@ from urllib.parse import quote_plus
 import discord
 from discord.ext.commands import Cog
 
-from cogs.utils import fetch_http, wait_for_deletion
+from cogs.cache import is_commit_sha, sizeof
+from cogs.jobs import guild_key, jobs
+from cogs.matcher import LinkMatcher
+from cogs.ratelimit import WIDGET
+from cogs.utils import fetch_http, pick, suppress_embeds, wait_for_deletion, widget_cache
 
 
 GITHUB_RE = re.compile(
@@ -25,6 +29,22 @@ GITLAB_RE = re.compile(
     r'(?P<commit>[^/\s]+)'
 )
 
+# The parts of each API's commit JSON the embeds show, which are all that's cached
+GITHUB_FIELDS = {
+    'sha': None, 'html_url': None, 'stats': {'additions': None, 'deletions': None},
+    'commit': {'message': None, 'author': {'date': None}}, 'author': {'login': None, 'avatar_url': None},
+}
+GITLAB_FIELDS = {
+    'id': None, 'message': None, 'web_url': None, 'authored_date': None, 'author_name': None, 'status': None,
+    'stats': {'additions': None, 'deletions': None},
+}
+
+
+def github_commit(commit):
+    """Picks the fields the embed shows, counting the files instead of keeping their diffs"""
+
+    return dict(pick(commit, GITHUB_FIELDS), files_changed=len(commit['files']))
+
 
 class CommitWidgets(Cog):
     def __init__(self, bot, session):
@@ -33,6 +53,12 @@ class CommitWidgets(Cog):
         self.bot = bot
         self.session = session
 
+        # Only used to skip messages without links. Each provider's links are still found with its own regex
+        self.matcher = LinkMatcher([
+            ('https://github.com/', GITHUB_RE, None),
+            ('https://gitlab.com/', GITLAB_RE, None),
+        ])
+
     @Cog.listener()
     async def on_message(self, message):
         """
@@ -40,92 +66,112 @@ class CommitWidgets(Cog):
         then sends a rich embed to Discord
         """
 
+        if message.author.bot or not self.matcher.might_match(message.content):
+            return
+
         gh_match = GITHUB_RE.search(message.content)
         gl_match = GITLAB_RE.search(message.content)
 
-        if (gh_match or gl_match) and not message.author.bot:
-
-            for gh in GITHUB_RE.finditer(message.content):
-                d = gh.groupdict()
-                headers = {}
-                if 'GITHUB_TOKEN' in os.environ:
-                    headers['Authorization'] = f'token {os.environ["GITHUB_TOKEN"]}'
-                commit = await fetch_http(
-                    self.session,
-                    f'https://api.github.com/repos/{d["owner"]}/{d["repo"]}/commits/{d["commit"]}',
-                    'json',
-                    headers=headers,
-                )
-
-                embed = discord.Embed(
-                    title=f'commit `{commit["sha"]}`',
-                    description=commit['commit']['message'],
-                    url=commit['html_url'],
-                    timestamp=datetime.datetime.fromisoformat(
-                        commit['commit']['author']['date'][:-1]
-                    ),
-                    color=0x111111
-                ).set_author(
-                    name=f'{d["owner"]}/{d["repo"]}',
-                    url=f'https://github.com/{d["owner"]}/{d["repo"]}'
-                ).add_field(
-                    name="Additions",
-                    value=str(commit['stats']['additions']),
-                    inline=True
-                ).add_field(
-                    name="Deletions",
-                    value=str(commit['stats']['deletions']),
-                    inline=True
-                ).add_field(
-                    name="Files Changed",
-                    value=str(len(commit['files'])),
-                    inline=True
-                ).set_footer(
-                    text=f'{commit["author"]["login"]} committed',
-                    icon_url=commit['author']['avatar_url']
-                )
-
-                await message.channel.send(embed=embed)
-
-            for gl in GITLAB_RE.finditer(message.content):
-                d = gl.groupdict()
-                headers = {}
-                if 'GITLAB_TOKEN' in os.environ:
-                    headers['PRIVATE-TOKEN'] = os.environ["GITLAB_TOKEN"]
-                commit = await fetch_http(
-                    self.session,
-                    f'https://gitlab.com/api/v4/projects/{quote_plus(d["owner"])}%2F{quote_plus(d["repo"])}/repository/commits/{d["commit"]}',
-                    'json',
-                    headers=headers,
-                )
-
-                embed = discord.Embed(
-                    title=f'commit `{commit["id"]}`',
-                    description=commit['message'],
-                    url=commit['web_url'],
-                    timestamp=datetime.datetime.fromisoformat(
-                        commit['authored_date']
-                    ),
-                    color=0x111111
-                ).set_author(
-                    name=f'{d["owner"]}/{d["repo"]}',
-                    url=f'https://gitlab.com/{d["owner"]}/{d["repo"]}'
-                ).add_field(
-                    name="Additions",
-                    value=str(commit['stats']['additions']),
-                    inline=True
-                ).add_field(
-                    name="Deletions",
-                    value=str(commit['stats']['deletions']),
-                    inline=True
-                ).add_field(
-                    name="Status",
-                    value=commit['status'],
-                    inline=True
-                ).set_footer(
-                    text=f'{commit["author_name"]} committed',
-                )
-
-                await wait_for_deletion(message, self.bot, embed, True)
-
-            await message.edit(suppress=True)
+        if gh_match or gl_match:
+            await jobs.run(guild_key(message), lambda: self.send_widgets(message))
+
+    async def send_widgets(self, message):
+        """Sends an embed for each commit link in message"""
+
+
+        for gh in GITHUB_RE.finditer(message.content):
+            d = gh.groupdict()
+            headers = {}
+            if 'GITHUB_TOKEN' in os.environ:
+                headers['Authorization'] = f'token {os.environ["GITHUB_TOKEN"]}'
+            commit = await fetch_http(
+                self.session,
+                f'https://api.github.com/repos/{d["owner"]}/{d["repo"]}/commits/{d["commit"]}',
+                'json',
+                cache=widget_cache,
+                # A commit at a full SHA can never change, but one at a short SHA or a branch can
+                immutable=is_commit_sha(d['commit']),
+                parse=github_commit,
+                measure=sizeof,
+                headers=headers,
+                priority=WIDGET,
+            )
+
+            embed = discord.Embed(
+                title=f'commit `{commit["sha"]}`',
+                description=commit['commit']['message'],
+                url=commit['html_url'],
+                timestamp=datetime.datetime.fromisoformat(
+                    commit['commit']['author']['date'][:-1]
+                ),
+                color=0x111111
+            ).set_author(
+                name=f'{d["owner"]}/{d["repo"]}',
+                url=f'https://github.com/{d["owner"]}/{d["repo"]}'
+            ).add_field(
+                name="Additions",
+                value=str(commit['stats']['additions']),
+                inline=True
+            ).add_field(
+                name="Deletions",
+                value=str(commit['stats']['deletions']),
+                inline=True
+            ).add_field(
+                name="Files Changed",
+                value=str(commit['files_changed']),
+                inline=True
+            ).set_footer(
+                text=f'{commit["author"]["login"]} committed',
+                icon_url=commit['author']['avatar_url']
+            )
+
+            await message.channel.send(embed=embed)
+
+        for gl in GITLAB_RE.finditer(message.content):
+            d = gl.groupdict()
+            headers = {}
+            if 'GITLAB_TOKEN' in os.environ:
+                headers['PRIVATE-TOKEN'] = os.environ["GITLAB_TOKEN"]
+            commit = await fetch_http(
+                self.session,
+                f'https://gitlab.com/api/v4/projects/{quote_plus(d["owner"])}%2F{quote_plus(d["repo"])}/repository/commits/{d["commit"]}',
+                'json',
+                cache=widget_cache,
+                immutable=is_commit_sha(d['commit']),
+                parse=lambda commit: pick(commit, GITLAB_FIELDS),
+                measure=sizeof,
+                headers=headers,
+                priority=WIDGET,
+            )
+
+            embed = discord.Embed(
+                title=f'commit `{commit["id"]}`',
+                description=commit['message'],
+                url=commit['web_url'],
+                timestamp=datetime.datetime.fromisoformat(
+                    commit['authored_date']
+                ),
+                color=0x111111
+            ).set_author(
+                name=f'{d["owner"]}/{d["repo"]}',
+                url=f'https://gitlab.com/{d["owner"]}/{d["repo"]}'
+            ).add_field(
+                name="Additions",
+                value=str(commit['stats']['additions']),
+                inline=True
+            ).add_field(
+                name="Deletions",
+                value=str(commit['stats']['deletions']),
+                inline=True
+            ).add_field(
+                name="Status",
+                value=commit['status'],
+                inline=True
+            ).set_footer(
+                text=f'{commit["author_name"]} committed',
+            )
+
+            await wait_for_deletion(message, self.bot, embed, True)
+
+        # The GitHub embeds are sent without wait_for_deletion, so the links' own embeds are suppressed here
+        await suppress_embeds(message)
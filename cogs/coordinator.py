@@ -0,0 +1,157 @@
+"""
+Shares the GitHub and GitLab rate limits between worker processes
+
+When the bot runs as several processes (see launcher.py), they all spend
+the same API quota. The launcher runs a Coordinator, and every worker
+reports how many requests each of its budgets wanted and the latest quota
+it saw over a local socket. The coordinator replies with the share of the
+rate each worker may use, weighted by demand, and the newest quota any
+worker saw
+
+Workers also report how many guilds their shards are in, so the one that
+posts the bot's server count to top.gg can post the total
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# The total guilds over every worker, from the coordinator's latest reply to sync_budgets
+cluster_stats = {'guilds': None}
+
+
+def budget_name(key):
+    return '/'.join(key)
+
+
+class Coordinator:
+    def __init__(self, workers, stale_after=10):
+        """
+        workers is the number of worker processes, and reports older than
+        stale_after seconds are ignored
+        """
+
+        self.workers = workers
+        self.stale_after = stale_after
+        # Keyed on budget name, maps worker ID to (requests wanted since its last report, time reported)
+        self.demand = {}
+        # Keyed on budget name, holds the newest (remaining, reset, time reported) any worker saw
+        self.quotas = {}
+        # Keyed on worker ID, holds the number of guilds its shards were last in
+        self.guilds = {}
+
+    def report(self, worker, budgets, guilds=None):
+        """
+        Records a worker's report, a dict of budget names to their demand
+        and quota, and returns the share and quota for each of them
+
+        guilds is the number of guilds the worker's shards are in, or None
+        until they're ready. The reply's total is None until every worker
+        has reported one
+        """
+
+        now = time.time()
+        if guilds is not None:
+            self.guilds[worker] = guilds
+        for name, budget in budgets.items():
+            self.demand.setdefault(name, {})[worker] = (budget['demand'], now)
+            quota = budget.get('quota')
+            if quota is not None and (name not in self.quotas or quota[2] > self.quotas[name][2]):
+                self.quotas[name] = quota
+
+        shares = {}
+        for name in budgets:
+            active = {
+                other: demand for other, (demand, reported) in self.demand[name].items()
+                if now - reported < self.stale_after
+            }
+            # Every worker keeps a share of at least one request, so it isn't starved until its next report
+            total = sum(demand + 1 for demand in active.values()) + self.workers - len(active)
+            shares[name] = {'share': (active[worker] + 1) / total, 'quota': self.quotas.get(name)}
+        total_guilds = sum(self.guilds.values()) if len(self.guilds) == self.workers else None
+        return {'workers': self.workers, 'budgets': shares, 'guilds': total_guilds}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                reply = self.report(message['worker'], message['budgets'], message.get('guilds'))
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except (OSError, ValueError, KeyError):
+            log.exception('Dropped a worker connection')
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8766):
+        """Starts listening for workers, returning the asyncio server"""
+
+        return await asyncio.start_server(self.handle, host, port)
+
+
+def budget_reports(scheduler, last_counts):
+    """
+    Returns a report of the requests each of scheduler's budgets wanted since
+    the last report, updating last_counts (budget name to requests sent and shed)
+    """
+
+    reports = {}
+    for key, budget in scheduler.budgets.items():
+        name = budget_name(key)
+        last_sent, last_shed = last_counts.get(name, (0, 0))
+        queued = sum(not future.done() for _, _, future in budget.queue)
+        reports[name] = {
+            'demand': budget.sent - last_sent + budget.shed - last_shed + queued,
+            'quota': budget.quota(),
+        }
+        last_counts[name] = (budget.sent, budget.shed)
+    return reports
+
+
+def apply_shares(scheduler, reply):
+    scheduler.default_share = 1 / reply['workers']
+    for key, budget in scheduler.budgets.items():
+        shared = reply['budgets'].get(budget_name(key))
+        if shared is None:
+            continue
+        budget.set_share(shared['share'])
+        if shared['quota'] is not None:
+            budget.merge_quota(*shared['quota'])
+
+
+async def sync_budgets(scheduler, worker, host='127.0.0.1', port=8766, interval=1, guild_count=None):
+    """
+    Reports scheduler's usage to the coordinator every interval seconds and
+    applies the shares it replies with, reconnecting if the connection drops
+
+    If given, guild_count() returns the worker's guilds (or None) to report
+    """
+
+    last_counts = {}
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                while True:
+                    message = {
+                        'worker': worker,
+                        'budgets': budget_reports(scheduler, last_counts),
+                        'guilds': None if guild_count is None else guild_count(),
+                    }
+                    writer.write(json.dumps(message).encode() + b'\n')
+                    await writer.drain()
+                    reply = json.loads(await reader.readline())
+                    apply_shares(scheduler, reply)
+                    cluster_stats['guilds'] = reply.get('guilds')
+                    await asyncio.sleep(interval)
+            finally:
+                writer.close()
+        except (OSError, ValueError):
+            log.warning('Lost the rate limit coordinator at %s:%s, retrying', host, port)
+            await asyncio.sleep(interval)
@@ -0,0 +1,101 @@
+"""
+Cog that deletes the bot's replies when the person who sent the link
+reacts to them with 🗑️
+
+Every watched reply is kept in one dict keyed on its message ID, so each
+reaction event is a single lookup, rather than a wait_for per reply that
+every reaction is checked against. Replies are watched for the same
+length of time, so they expire in the order they were sent, and a single
+task works through them oldest first
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import discord
+from discord.ext.commands import Cog
+
+DELETE_EMOJI = '🗑️'
+
+log = logging.getLogger(__name__)
+
+
+class DeleteReactions(Cog):
+    def __init__(self, bot):
+        """Sets the cog's bot and how long and how many replies are watched for"""
+
+        self.bot = bot
+        self.timeout = float(os.environ.get('DELETE_TIMEOUT', 10))
+        # Past this many, the oldest replies stop being watched early
+        self.max_watched = int(os.environ.get('DELETE_MAX_WATCHED', 10000))
+
+        # Keyed on reply message ID, holds (reply, ID of the user who may delete it)
+        self.watched = {}
+        # (expiry time, reply message ID) in the order replies were sent
+        self.expiry = deque()
+        self.sweeper = None
+
+    def watch(self, reply, author_id):
+        """Deletes reply if author_id reacts to it with 🗑️ in the next self.timeout seconds"""
+
+        while len(self.watched) >= self.max_watched:
+            self.expire(self.expiry.popleft()[1])
+
+        self.watched[reply.id] = (reply, author_id)
+        self.expiry.append((time.monotonic() + self.timeout, reply.id))
+        if self.sweeper is None:
+            self.sweeper = asyncio.ensure_future(self.sweep())
+
+    def expire(self, message_id):
+        """Stops watching a reply and removes the bot's 🗑️ from it, if it's still there"""
+
+        watched = self.watched.pop(message_id, None)
+        if watched is not None:
+            asyncio.ensure_future(self.remove_reaction(watched[0]))
+
+    async def remove_reaction(self, reply):
+        try:
+            await reply.remove_reaction(DELETE_EMOJI, self.bot.user)
+        except discord.HTTPException:
+            # The reply was most likely deleted by a moderator
+            log.debug('Failed to remove the delete reaction from %s', reply.id)
+
+    async def sweep(self):
+        """Expires watched replies as their time runs out"""
+
+        try:
+            while self.expiry:
+                expires, message_id = self.expiry[0]
+                delay = expires - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+
+                self.expiry.popleft()
+                self.expire(message_id)
+        finally:
+            self.sweeper = None
+
+    @Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        """Deletes a watched reply when its author reacts with 🗑️"""
+
+        watched = self.watched.get(payload.message_id)
+        if watched is None:
+            return
+
+        reply, author_id = watched
+        if payload.user_id == author_id and str(payload.emoji) == DELETE_EMOJI:
+            # Its entry in self.expiry is skipped when it comes up
+            del self.watched[payload.message_id]
+            try:
+                await reply.delete()
+            except discord.HTTPException:
+                log.debug('Failed to delete %s', reply.id)
+
+    def cog_unload(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
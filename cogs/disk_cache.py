@@ -0,0 +1,155 @@
+"""
+SQLite-backed tier under the in-memory file cache
+
+Keeps fetched files across restarts so a deploy doesn't start with a
+cold cache, and is shared by the worker processes when the bot is run
+with launcher.py. Bodies are stored zlib-compressed, and SQLite's memory-mapped
+I/O serves reads without copying through the page cache. All database
+work runs on a single background thread to keep it off the event loop
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from cogs.cache import Blob
+
+log = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    complete INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    immutable INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed);
+CREATE INDEX IF NOT EXISTS blobs_hits ON blobs (hits);
+'''
+
+
+class DiskCache:
+    def __init__(self, path, max_bytes):
+        """Opens (or creates) the cache database at path"""
+
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(f'PRAGMA mmap_size={int(max_bytes)}')
+        self.db.executescript(SCHEMA)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    async def get(self, key):
+        """Returns (blob, seconds until it goes stale), or (None, 0) if key isn't cached"""
+
+        return await self.run(self.get_sync, key)
+
+    async def set(self, key, blob, ttl, immutable=False):
+        """Stores blob under key, evicting the least recently used entries if over budget"""
+
+        await self.run(self.set_sync, key, blob, ttl, immutable)
+
+    async def hottest(self, limit):
+        """
+        Returns (key, blob, seconds until it goes stale, immutable) for the
+        entries that have been fetched or read the most
+        """
+
+        return await self.run(self.hottest_sync, limit)
+
+    def get_sync(self, key):
+        try:
+            row = self.db.execute(
+                'SELECT data, complete, etag, last_modified, expires FROM blobs WHERE key = ?',
+                (json.dumps(key),),
+            ).fetchone()
+            if row is not None:
+                with self.db:
+                    self.db.execute(
+                        'UPDATE blobs SET hits = hits + 1, accessed = ? WHERE key = ?',
+                        (time.time(), json.dumps(key)),
+                    )
+        except sqlite3.Error:
+            # Most likely another worker process holding a lock for too long
+            log.exception('Failed to read %s from the disk cache', key)
+            row = None
+
+        if row is None:
+            self.misses += 1
+            return None, 0
+
+        self.hits += 1
+        return self.row_blob(row[:4]), row[4] - time.time()
+
+    def set_sync(self, key, blob, ttl, immutable):
+        data = zlib.compress(blob.text.encode('utf-8', 'surrogatepass'))
+        if len(data) > self.max_bytes:
+            return
+
+        try:
+            with self.db:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO blobs '
+                    '(key, data, size, complete, etag, last_modified, immutable, expires, hits, accessed) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, '
+                    'COALESCE((SELECT hits FROM blobs WHERE key = ?), 0) + 1, ?)',
+                    (json.dumps(key), data, len(data), blob.complete, blob.etag, blob.last_modified,
+                     immutable, time.time() + ttl, json.dumps(key), time.time()),
+                )
+                self.evict()
+        except sqlite3.Error:
+            log.exception('Failed to write %s to the disk cache', key)
+
+    def evict(self):
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in self.db.execute('SELECT key, size FROM blobs ORDER BY accessed').fetchall():
+            self.db.execute('DELETE FROM blobs WHERE key = ?', (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def hottest_sync(self, limit):
+        rows = self.db.execute(
+            'SELECT key, data, complete, etag, last_modified, expires, immutable FROM blobs '
+            'ORDER BY hits DESC LIMIT ?',
+            (limit,),
+        ).fetchall()
+        now = time.time()
+        return [
+            (tuple(json.loads(row[0])), self.row_blob(row[1:5]), row[5] - now, bool(row[6]))
+            for row in rows
+        ]
+
+    @staticmethod
+    def row_blob(row):
+        data, complete, etag, last_modified = row
+        return Blob(zlib.decompress(data).decode('utf-8', 'surrogatepass'), bool(complete), etag, last_modified)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def close(self):
+        self.executor.shutdown()
+        self.db.close()
@@ -0,0 +1,153 @@
+"""
+Bounded queue of link-handling jobs, served by a fixed pool of workers
+
+Every message with links becomes a job queued under its guild. Workers
+take jobs from the guilds in turn, so one guild flooding the bot with
+links can't starve the others, and no more than a fixed number of
+messages are fetched and rendered at once. When the queue is full, jobs
+are either rejected or make room by dropping the oldest job of the
+guild with the most queued
+"""
+
+import asyncio
+import contextvars
+import os
+import time
+from collections import OrderedDict, deque
+
+from cogs.metrics import Counter, Histogram, collector
+
+DROP_OLDEST = 'drop_oldest'
+REJECT = 'reject'
+
+jobs_dropped = Counter('gitthelines_jobs_dropped_total', 'Jobs dropped because the queue was full, by policy')
+job_wait_seconds = Histogram('gitthelines_job_wait_seconds', 'Time jobs spent queued before a worker took them')
+
+
+class JobQueue:
+    def __init__(self, workers, max_size, policy=DROP_OLDEST):
+        """Sets the number of workers, the most jobs that may be queued and what to do when full"""
+
+        if policy not in (DROP_OLDEST, REJECT):
+            raise ValueError(f'Unknown queue policy {policy}')
+
+        self.workers = workers
+        self.max_size = max_size
+        self.policy = policy
+
+        # Keyed on guild, holds a deque of (func, future, time queued, context). Workers
+        # take from the first guild and move it to the end
+        self.queues = OrderedDict()
+        self.size = 0
+        # Set while there are jobs queued. Made with the workers, once there's an event loop
+        self.ready = None
+        self.loop = None
+        self.tasks = []
+        self.busy = 0
+
+    async def run(self, key, func):
+        """
+        Queues func() under key, returning its result once a worker has run
+        it, or None if it was dropped
+        """
+
+        if self.size >= self.max_size:
+            if self.policy == REJECT:
+                jobs_dropped.inc(policy=REJECT)
+                return None
+            self.drop_oldest()
+
+        loop = asyncio.get_event_loop()
+        if self.loop is not loop:
+            # Jobs queued on another loop can never be run
+            self.queues.clear()
+            self.size = 0
+            self.loop = loop
+            self.ready = asyncio.Event()
+            self.tasks = [asyncio.ensure_future(self.work()) for _ in range(self.workers)]
+
+        future = loop.create_future()
+        # The job runs in the caller's context, so it's part of the caller's trace
+        job = (func, future, time.perf_counter(), contextvars.copy_context())
+        self.queues.setdefault(key, deque()).append(job)
+        self.size += 1
+        self.ready.set()
+        return await future
+
+    def drop_oldest(self):
+        """Drops the oldest job of the guild with the most jobs queued"""
+
+        key = max(self.queues, key=lambda queued: len(self.queues[queued]))
+        future = self.take(key)[1]
+        jobs_dropped.inc(policy=DROP_OLDEST)
+        if not future.done():
+            future.set_result(None)
+
+    def take(self, key):
+        queue = self.queues[key]
+        job = queue.popleft()
+        self.size -= 1
+        if queue:
+            self.queues.move_to_end(key)
+        else:
+            del self.queues[key]
+        return job
+
+    async def work(self):
+        while True:
+            if not self.queues:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+
+            func, future, queued, context = self.take(next(iter(self.queues)))
+            if future.done():
+                # Whoever was waiting on it was cancelled
+                continue
+
+            job_wait_seconds.observe(time.perf_counter() - queued)
+            self.busy += 1
+            try:
+                # Tasks copy the context they're created in
+                result = await context.run(lambda: asyncio.ensure_future(func()))
+            except Exception as error:
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.busy -= 1
+
+    def stats(self):
+        return {'queued': self.size, 'guilds': len(self.queues), 'busy': self.busy, 'workers': self.workers}
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.loop = None
+
+
+# Shared by every cog that handles links
+jobs = JobQueue(
+    workers=int(os.environ.get('JOB_WORKERS', 32)),
+    max_size=int(os.environ.get('JOB_QUEUE_SIZE', 1000)),
+    policy=os.environ.get('JOB_QUEUE_POLICY', DROP_OLDEST),
+)
+
+
+def guild_key(message):
+    """Returns the key a message's jobs are queued under, its guild or else its DM channel"""
+
+    return ('guild', message.guild.id) if message.guild is not None else ('channel', message.channel.id)
+
+
+@collector
+def job_metrics():
+    stats = jobs.stats()
+    return [
+        ('gitthelines_job_queue_depth', 'Jobs waiting for a worker', {(): stats['queued']}),
+        ('gitthelines_job_queue_guilds', 'Guilds with jobs waiting', {(): stats['guilds']}),
+        ('gitthelines_job_workers_busy', 'Workers running a job', {(): stats['busy']}),
+    ]
@@ -0,0 +1,49 @@
+"""
+Matches links from several providers in a single pass over a message
+
+Most messages don't contain any links, so a cheap substring check on the
+providers' URL prefixes runs before the combined regex
+"""
+
+import re
+
+GROUP_NAME_RE = re.compile(r'\(\?P<(\w+)>')
+
+
+class LinkMatcher:
+    def __init__(self, providers):
+        """
+        Builds the combined regex
+
+        providers is a list of (url_prefix, pattern, handler) tuples, where
+        url_prefix is a string every match of pattern contains
+        """
+
+        self.prefixes = tuple(prefix for prefix, _, _ in providers)
+        self.handlers = {}
+
+        alternatives = []
+        for i, (_, pattern, handler) in enumerate(providers):
+            name = f'p{i}'
+            # Group names have to be unique across the alternation
+            source = GROUP_NAME_RE.sub(rf'(?P<{name}_\1>', pattern.pattern)
+            alternatives.append(f'(?P<{name}>{source})')
+            self.handlers[name] = (handler, [(group, f'{name}_{group}') for group in pattern.groupindex])
+
+        self.pattern = re.compile('|'.join(alternatives))
+
+    def might_match(self, content):
+        """Checks if content contains any of the providers' URL prefixes"""
+
+        return 'https://' in content and any(prefix in content for prefix in self.prefixes)
+
+    def finditer(self, content):
+        """Yields (handler, kwargs, link) for each link in content, in order"""
+
+        if not self.might_match(content):
+            return
+
+        for match in self.pattern.finditer(content):
+            # The provider's outer group is the last one to close
+            handler, groups = self.handlers[match.lastgroup]
+            yield handler, {group: match.group(prefixed) for group, prefixed in groups}, match.group(0)
@@ -0,0 +1,169 @@
+"""
+Prometheus-style metrics for the bot
+
+Counters and histograms are updated on the hot paths, and collectors
+read the caches' and schedulers' own counters when metrics are scraped.
+Everything can be served in the Prometheus text format on a local
+/metrics endpoint
+"""
+
+import bisect
+import re
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# Upper bounds of latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+ENDPOINT_RE = re.compile(r'/(branches|tags|contents|files|gists|raw|commits|pulls)(/|$|\?)')
+
+metrics = []
+collectors = []
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def total(self):
+        return sum(self.values.values())
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in self.values.items():
+            yield f'{self.name}{format_labels(labels)} {value}'
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # Maps labels to [count per bucket (plus +Inf), sum]
+        self.values = {}
+        metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        if key not in self.values:
+            self.values[key] = [[0] * (len(self.buckets) + 1), 0]
+        counts = self.values[key]
+        counts[0][bisect.bisect_left(self.buckets, value)] += 1
+        counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes how long the body of the with statement takes"""
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def quantile(self, fraction):
+        """Estimates a quantile across all labels from the bucket upper bounds"""
+
+        counts = [sum(values[0][i] for values in self.values.values()) for i in range(len(self.buckets) + 1)]
+        total = sum(counts)
+        if total == 0:
+            return None
+
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= fraction * total:
+                return bound
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}'
+            yield f'{self.name}_sum{format_labels(labels)} {total}'
+            yield f'{self.name}_count{format_labels(labels)} {cumulative}'
+
+
+def collector(func):
+    """
+    Registers a function called on every scrape, which returns a list of
+    (name, help text, {labels tuple: value}) gauges
+    """
+
+    collectors.append(func)
+    return func
+
+
+def endpoint(url):
+    """Returns a low-cardinality label for the API endpoint a URL points at"""
+
+    match = ENDPOINT_RE.search(url)
+    return 'other' if match is None else match.group(1)
+
+
+messages_processed = Counter('gitthelines_messages_processed_total', 'Messages seen by the snippet cog')
+messages_matched = Counter('gitthelines_messages_matched_total', 'Messages that contained snippet links')
+snippet_plans = Counter(
+    'gitthelines_snippet_plans_total',
+    'Links planned into a reply, by whether they fit, were cut short, were whole files or were skipped',
+)
+match_seconds = Histogram(
+    'gitthelines_match_seconds', 'Time spent matching links in a message',
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01),
+)
+message_seconds = Histogram('gitthelines_message_seconds', 'Time from a message to its reply being ready')
+snippet_seconds = Histogram('gitthelines_snippet_seconds', 'Time to fetch and render a snippet, by provider')
+ref_resolution_seconds = Histogram(
+    'gitthelines_ref_resolution_seconds', "Time to list a repo's refs when a link's ref is unknown")
+file_fetch_seconds = Histogram('gitthelines_file_fetch_seconds', 'Time to fetch a file, including cache hits')
+reply_seconds = Histogram('gitthelines_reply_seconds', 'Time to send a reply and set up its delete reaction')
+upstream_requests = Counter('gitthelines_upstream_requests_total', 'Requests to providers by host, endpoint and status')
+upstream_seconds = Histogram('gitthelines_upstream_seconds', 'Time until providers send response headers, by host')
+
+
+def render():
+    """Renders every metric in the Prometheus text format"""
+
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for func in collectors:
+        for name, help_text, values in func():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(f'{name}{format_labels(labels)} {value}' for labels, value in values.items())
+    return '\n'.join(lines) + '\n'
+
+
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type='text/plain')
+
+
+async def start_metrics_server(port, host='127.0.0.1'):
+    """Serves /metrics on host:port, returning the runner to clean up with"""
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
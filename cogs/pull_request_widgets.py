@@ -12,7 +12,11 @@ import re
 import discord
 from discord.ext.commands import Cog
 
-from cogs.utils import fetch_http, wait_for_deletion
+from cogs.cache import sizeof
+from cogs.jobs import guild_key, jobs
+from cogs.matcher import LinkMatcher
+from cogs.ratelimit import WIDGET
+from cogs.utils import fetch_http, pick, wait_for_deletion, widget_cache
 
 COLORS = {
     "Closed": 0xd73a49,
@@ -25,6 +29,15 @@ GITHUB_RE = re.compile(
     r'https://github\.com/(?P<owner>[^/\s]+)/(?P<repo>[^/\s]+)/pull/'
     r'(?P<pr>[^/\s]+)')
 
+# The parts of the pull request JSON the embed shows, which are all that's cached.
+# The rest includes the full JSON of the head and base repos
+GITHUB_FIELDS = {
+    'title': None, 'number': None, 'body': None, 'html_url': None, 'created_at': None, 'state': None,
+    'draft': None, 'merged': None, 'mergeable': None, 'additions': None, 'deletions': None,
+    'changed_files': None, 'commits': None, 'user': {'login': None, 'avatar_url': None},
+    'merged_by': {'login': None},
+}
+
 
 class PullRequestWidgets(Cog):
     def __init__(self, bot, session):
@@ -33,6 +46,9 @@ class PullRequestWidgets(Cog):
         self.bot = bot
         self.session = session
 
+        # Only used to skip messages without links
+        self.matcher = LinkMatcher([('https://github.com/', GITHUB_RE, None)])
+
     @Cog.listener()
     async def on_message(self, message):
         """
@@ -40,79 +56,89 @@ class PullRequestWidgets(Cog):
         then sends a rich embed to Discord
         """
 
-        gh_match = GITHUB_RE.search(message.content)
+        if message.author.bot or not self.matcher.might_match(message.content):
+            return
 
-        if gh_match and not message.author.bot:
-            for gh in GITHUB_RE.finditer(message.content):
-                d = gh.groupdict()
-                headers = {}
-                if 'GITHUB_TOKEN' in os.environ:
-                    headers[
-                        'Authorization'] = f'token {os.environ["GITHUB_TOKEN"]}'
-                pull_request = await fetch_http(
-                    self.session,
-                    f'https://api.github.com/repos/{d["owner"]}/{d["repo"]}/pulls/{d["pr"]}',
-                    'json',
-                    headers=headers,
-                )
+        gh_match = GITHUB_RE.search(message.content)
 
-                body = pull_request["body"]
-                if len(body) > 512:
-                    body = body[:512] + "..."
-
-                state = pull_request['state'].capitalize()
-                if pull_request['draft']:
-                    state = 'Draft'
-                if pull_request['merged']:
-                    state = 'Merged'
-
-                embed = discord.Embed(
-                    title=f'{pull_request["title"]} (#{pull_request["number"]})',
-                    description=body,
-                    url=pull_request['html_url'],
-                    timestamp=datetime.datetime.fromisoformat(pull_request['created_at'][:-1]),
-                    color=COLORS[state],
-                ).set_author(
-                    name=f'{d["owner"]}/{d["repo"]}',
-                    url=f'https://github.com/{d["owner"]}/{d["repo"]}',
-                ).add_field(
-                    name="Status",
-                    value=state,
-                    inline=True,
-                ).add_field(
-                    name="Additions",
-                    value=str(pull_request['additions']),
-                    inline=True,
-                ).add_field(
-                    name="Deletions",
-                    value=str(pull_request['deletions']),
+        if gh_match:
+            await jobs.run(guild_key(message), lambda: self.send_widgets(message))
+
+    async def send_widgets(self, message):
+        """Sends an embed for each pull request link in message"""
+
+        for gh in GITHUB_RE.finditer(message.content):
+            d = gh.groupdict()
+            headers = {}
+            if 'GITHUB_TOKEN' in os.environ:
+                headers[
+                    'Authorization'] = f'token {os.environ["GITHUB_TOKEN"]}'
+            pull_request = await fetch_http(
+                self.session,
+                f'https://api.github.com/repos/{d["owner"]}/{d["repo"]}/pulls/{d["pr"]}',
+                'json',
+                cache=widget_cache,
+                parse=lambda pull_request: pick(pull_request, GITHUB_FIELDS),
+                measure=sizeof,
+                headers=headers,
+                priority=WIDGET,
+            )
+
+            body = pull_request["body"]
+            if len(body) > 512:
+                body = body[:512] + "..."
+
+            state = pull_request['state'].capitalize()
+            if pull_request['draft']:
+                state = 'Draft'
+            if pull_request['merged']:
+                state = 'Merged'
+
+            embed = discord.Embed(
+                title=f'{pull_request["title"]} (#{pull_request["number"]})',
+                description=body,
+                url=pull_request['html_url'],
+                timestamp=datetime.datetime.fromisoformat(pull_request['created_at'][:-1]),
+                color=COLORS[state],
+            ).set_author(
+                name=f'{d["owner"]}/{d["repo"]}',
+                url=f'https://github.com/{d["owner"]}/{d["repo"]}',
+            ).add_field(
+                name="Status",
+                value=state,
+                inline=True,
+            ).add_field(
+                name="Additions",
+                value=str(pull_request['additions']),
+                inline=True,
+            ).add_field(
+                name="Deletions",
+                value=str(pull_request['deletions']),
+                inline=True,
+            ).add_field(
+                name="Files Changed",
+                value=str(pull_request['changed_files']),
+                inline=True,
+            ).add_field(
+                name="Commits",
+                value=str(pull_request['commits']),
+                inline=True,
+            ).set_footer(
+                text=f'Pull request created by {pull_request["user"]["login"]}',
+                icon_url=pull_request['user']['avatar_url'],
+            )
+
+            if pull_request["merged"]:
+                embed = embed.add_field(
+                    name='Merged By',
+                    value=pull_request['merged_by']['login'],
                     inline=True,
-                ).add_field(
-                    name="Files Changed",
-                    value=str(pull_request['changed_files']),
-                    inline=True,
-                ).add_field(
-                    name="Commits",
-                    value=str(pull_request['commits']),
+                )
+            else:
+                embed = embed.add_field(
+                    name='State',
+                    value='Mergeable' if pull_request['mergeable'] else 'Not Mergeable',
                     inline=True,
-                ).set_footer(
-                    text=f'Pull request created by {pull_request["user"]["login"]}',
-                    icon_url=pull_request['user']['avatar_url'],
                 )
 
-                if pull_request["merged"]:
-                    embed = embed.add_field(
-                        name='Merged By',
-                        value=pull_request['merged_by']['login'],
-                        inline=True,
-                    )
-                else:
-                    embed = embed.add_field(
-                        name='State',
-                        value='Mergeable' if pull_request['mergeable'] else 'Not Mergeable',
-                        inline=True,
-                    )
-
-                await wait_for_deletion(message, self.bot, embed, True)
-
-            await message.edit(suppress=True)
+            await wait_for_deletion(message, self.bot, embed, True)
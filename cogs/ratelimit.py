@@ -0,0 +1,240 @@
+"""
+Paces requests to the GitHub and GitLab APIs
+
+Each (host, token) pair gets a token bucket whose rate adapts to the
+quota the API reports in its response headers. Requests queue by
+priority, and are shed with RateLimitExceeded rather than queued when
+the budget can't serve them in time
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import time
+from urllib.parse import urlsplit
+
+# Request priorities, lower goes first
+SNIPPET = 0
+WIDGET = 1
+
+RATE_LIMITED_HOSTS = {'api.github.com', 'gitlab.com'}
+
+# Never pace slower than this many requests per second while quota remains
+MIN_RATE = 0.1
+
+# Requests go out at the full rate until that would use up this process's
+# share of the quota in under this many seconds, and are only spread out
+# over the time left until it resets after that
+PACE_HORIZON = 60
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request is shed because the host's budget is exhausted"""
+
+
+def header(headers, *names):
+    """Returns the first of the headers that's present, or None"""
+
+    for name in names:
+        if name in headers:
+            return headers[name]
+    return None
+
+
+class Budget:
+    """Token bucket and request queue for one host and token"""
+
+    def __init__(self, rate, burst, max_wait, max_queue, share=1):
+        self.full_rate = rate
+        self.full_burst = burst
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.updated = time.monotonic()
+
+        self.share = share
+        self.max_rate = self.rate = share * rate
+        self.burst = self.tokens = max(1, share * burst)
+
+        # Quota reported by the API, with reset as a time.monotonic() value,
+        # and the time.time() it was reported at
+        self.remaining = None
+        self.reset = None
+        self.observed = None
+
+        self.queue = []
+        self.seq = itertools.count()
+        self.pump = None
+
+        self.sent = 0
+        self.shed = 0
+
+    def delay(self):
+        """Returns how many seconds until the next request may be sent"""
+
+        now = time.monotonic()
+        if self.reset is not None and self.reset <= now:
+            self.remaining = self.reset = None
+            self.rate = self.max_rate
+        if self.remaining == 0 and self.reset is not None:
+            return self.reset - now
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self, priority):
+        """Waits until a request with the given priority may be sent"""
+
+        if not self.queue and self.delay() <= 0:
+            self.take()
+            return
+
+        expected_wait = self.delay() + len(self.queue) / self.rate
+        if len(self.queue) >= self.max_queue or expected_wait > self.max_wait:
+            self.shed += 1
+            raise RateLimitExceeded(f'{len(self.queue)} requests queued, {self.remaining} remaining')
+
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.queue, (priority, next(self.seq), future))
+        if self.pump is None:
+            self.pump = asyncio.ensure_future(self.run())
+        # A cancelled waiter leaves a cancelled future in the queue, which run() skips
+        await future
+
+    def take(self):
+        self.tokens -= 1
+        self.sent += 1
+        if self.remaining:
+            self.remaining -= 1
+
+    async def run(self):
+        """Hands out tokens to queued requests as they become available"""
+
+        try:
+            while self.queue:
+                delay = self.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+
+                _, _, future = heapq.heappop(self.queue)
+                if not future.done():
+                    self.take()
+                    future.set_result(None)
+        finally:
+            self.pump = None
+
+    def update(self, headers, status):
+        """Updates the quota from a response's rate limit headers"""
+
+        now = time.monotonic()
+
+        remaining = header(headers, 'X-RateLimit-Remaining', 'RateLimit-Remaining')
+        if remaining is not None and remaining.isdigit():
+            self.remaining = int(remaining)
+            self.observed = time.time()
+
+        # Both APIs report when the quota resets as a Unix timestamp
+        reset = header(headers, 'X-RateLimit-Reset', 'RateLimit-Reset')
+        if reset is not None and reset.isdigit():
+            self.reset = now + max(0, int(reset) - time.time())
+            self.observed = time.time()
+
+        retry_after = headers.get('Retry-After')
+        if status in (403, 429) and retry_after is not None and retry_after.isdigit():
+            self.remaining = 0
+            self.reset = now + int(retry_after)
+            self.observed = time.time()
+
+        self.pace(now)
+
+    def pace(self, now):
+        """Spreads this process's share of the remaining quota evenly until it resets, once it runs low"""
+
+        if self.remaining is None or self.reset is None or self.reset <= now:
+            return
+
+        left = self.share * self.remaining
+        if left > self.max_rate * PACE_HORIZON:
+            self.rate = self.max_rate
+        else:
+            self.rate = min(self.max_rate, max(MIN_RATE, left / (self.reset - now)))
+
+    def set_share(self, share):
+        """Limits this process to a share of the rate, when other processes use the same quota"""
+
+        self.share = share
+        self.max_rate = share * self.full_rate
+        self.burst = max(1, share * self.full_burst)
+        self.rate = self.max_rate
+        self.tokens = min(self.tokens, self.burst)
+        self.pace(time.monotonic())
+
+    def quota(self):
+        """Returns the last quota the API reported as (remaining, reset Unix time, time reported), or None"""
+
+        if self.observed is None:
+            return None
+        reset = None if self.reset is None else time.time() + self.reset - time.monotonic()
+        return self.remaining, reset, self.observed
+
+    def merge_quota(self, remaining, reset, observed):
+        """Takes on a quota another process saw, if it's newer than the last one this process saw"""
+
+        if self.observed is not None and observed <= self.observed:
+            return
+
+        now = time.monotonic()
+        self.remaining = remaining
+        self.reset = None if reset is None else now + max(0, reset - time.time())
+        self.observed = observed
+        self.pace(now)
+
+    def stats(self):
+        return {
+            'queued': sum(not future.done() for _, _, future in self.queue),
+            'remaining': self.remaining,
+            'reset_in': None if self.reset is None else max(0, round(self.reset - time.monotonic())),
+            'rate': self.rate,
+            'share': self.share,
+            'sent': self.sent,
+            'shed': self.shed,
+        }
+
+
+class Scheduler:
+    """Keeps a Budget for each rate limited host and token"""
+
+    def __init__(self, rate, burst, max_wait, max_queue):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.budgets = {}
+
+        # Share of each budget new budgets start with, lowered when several processes share the quota
+        self.default_share = 1
+
+    def budget(self, url, headers):
+        """Returns the Budget for a request, or None if its host isn't rate limited"""
+
+        host = urlsplit(url).hostname
+        if host not in RATE_LIMITED_HOSTS:
+            return None
+
+        token = header(headers or {}, 'Authorization', 'PRIVATE-TOKEN')
+        # Never keep the token itself around where it could end up in stats
+        token_id = 'anonymous' if token is None else hashlib.sha256(token.encode()).hexdigest()[:8]
+
+        key = (host, token_id)
+        if key not in self.budgets:
+            self.budgets[key] = Budget(self.rate, self.burst, self.max_wait, self.max_queue, self.default_share)
+        return self.budgets[key]
+
+    def stats(self):
+        """Returns the queue depth and quota of every budget"""
+
+        return {f'{host}/{token_id}': budget.stats() for (host, token_id), budget in self.budgets.items()}
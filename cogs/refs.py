@@ -0,0 +1,55 @@
+"""
+Index of a repo's branch and tag names
+
+Snippet links look like `<ref>/<file path>`, and refs can contain slashes
+themselves, so the ref is found by the longest prefix of the path that is
+a known ref name
+"""
+
+
+class RefTrie:
+    """Trie over the `/`-separated segments of ref names"""
+
+    def __init__(self, names=()):
+        self._root = {}
+        self.size = 0
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        """Adds a ref name to the trie"""
+
+        node = self._root
+        for segment in name.split('/'):
+            node = node.setdefault(segment, {})
+        # None can never be a path segment, so it marks the end of a ref
+        node[None] = True
+        self.size += len(name)
+
+    def longest_prefix(self, path):
+        """
+        Returns the longest ref that path starts with, leaving at least
+        one segment for the file path, or None if there is no such ref
+        """
+
+        segments = path.split('/')
+        node = self._root
+        longest = None
+        for depth, segment in enumerate(segments[:-1], 1):
+            node = node.get(segment)
+            if node is None:
+                break
+            if None in node:
+                longest = depth
+        if longest is None:
+            return None
+        return '/'.join(segments[:longest])
+
+    def split(self, path):
+        """Splits path into a ref and a file path"""
+
+        ref = self.longest_prefix(path)
+        if ref is None:
+            ref, _, file_path = path.partition('/')
+            return ref, file_path
+        return ref, path[len(ref) + 1:]
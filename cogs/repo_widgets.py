@@ -12,13 +12,27 @@ from urllib.parse import quote_plus
 import discord
 from discord.ext.commands import Cog
 
-from cogs.utils import fetch_http, wait_for_deletion
+from cogs.cache import sizeof
+from cogs.jobs import guild_key, jobs
+from cogs.matcher import LinkMatcher
+from cogs.ratelimit import WIDGET
+from cogs.utils import fetch_http, pick, suppress_embeds, wait_for_deletion, widget_cache
 
 
 GITHUB_RE = re.compile(
-    r'https://github\.com/(?P<owner>[^/]+?)/(?P<repo>[^/]+?)(?:\s|$)')
+    r'https://github\.com/(?P<owner>[^/\s]+?)/(?P<repo>[^/\s]+?)(?:\s|$)')
 GITLAB_RE = re.compile(
-    r'https://gitlab\.com/(?P<owner>[^/]+?)/(?P<repo>[^/]+?)(?:\s|$)')
+    r'https://gitlab\.com/(?P<owner>[^/\s]+?)/(?P<repo>[^/\s]+?)(?:\s|$)')
+
+# The parts of each API's repo JSON the embeds show, which are all that's cached
+GITHUB_FIELDS = {
+    'full_name': None, 'description': None, 'html_url': None, 'language': None, 'stargazers_count': None,
+    'forks_count': None, 'size': None, 'homepage': None, 'owner': {'avatar_url': None},
+}
+GITLAB_FIELDS = {
+    'path_with_namespace': None, 'description': None, 'web_url': None, 'star_count': None, 'forks_count': None,
+    'avatar_url': None,
+}
 
 
 class RepoWidgets(Cog):
@@ -28,6 +42,12 @@ class RepoWidgets(Cog):
         self.bot = bot
         self.session = session
 
+        # Only used to skip messages without links. Each provider's links are still found with its own regex
+        self.matcher = LinkMatcher([
+            ('https://github.com/', GITHUB_RE, None),
+            ('https://gitlab.com/', GITLAB_RE, None),
+        ])
+
     @Cog.listener()
     async def on_message(self, message):
         """
@@ -35,64 +55,81 @@ class RepoWidgets(Cog):
         then sends a rich embed to Discord
         """
 
+        if message.author.bot or not self.matcher.might_match(message.content):
+            return
+
         gh_match = GITHUB_RE.search(message.content)
         gl_match = GITLAB_RE.search(message.content)
 
-        if (gh_match or gl_match) and not message.author.bot:
-            for gh in GITHUB_RE.finditer(message.content):
-                d = gh.groupdict()
-                headers = {}
-                if 'GITHUB_TOKEN' in os.environ:
-                    headers['Authorization'] = f'token {os.environ["GITHUB_TOKEN"]}'
-                repo = await fetch_http(
-                    self.session,
-                    f'https://api.github.com/repos/{d["owner"]}/{d["repo"]}',
-                    'json',
-                    headers=headers,
-                )
-
-                embed = discord.Embed(
-                    title=repo['full_name'],
-                    description='No description provided' if repo[
-                        'description'] is None else repo['description'],
-                    url=repo['html_url'],
-                    color=0x111111
-                ).set_footer(
-                    text=f'Language: {repo["language"]} | ' +
-                         f'Stars: {repo["stargazers_count"]} | ' +
-                         f'Forks: {repo["forks_count"]} | ' +
-                         f'Size: {repo["size"]}kb'
-                ).set_thumbnail(url=repo['owner']['avatar_url'])
-                if repo['homepage']:
-                    embed.add_field(name='Website', value=repo['homepage'])
-                await message.channel.send(embed=embed)
-
-            for gl in GITLAB_RE.finditer(message.content):
-                d = gl.groupdict()
-                headers = {}
-                if 'GITLAB_TOKEN' in os.environ:
-                    headers['PRIVATE-TOKEN'] = os.environ["GITLAB_TOKEN"]
-                repo = await fetch_http(
-                    self.session,
-                    f'https://gitlab.com/api/v4/projects/{quote_plus(d["owner"])}%2F{quote_plus(d["repo"])}',
-                    'json',
-                    headers=headers,
-                )
-
-                embed = discord.Embed(
-                    title=repo['path_with_namespace'],
-                    description='No description provided' if repo[
-                        'description'] == "" else repo['description'],
-                    url=repo['web_url'],
-                    color=0x111111
-                ).set_footer(
-                    text=f'Stars: {repo["star_count"]} | ' +
-                         f'Forks: {repo["forks_count"]}'
-                )
-
-                if repo['avatar_url'] is not None:
-                    embed.set_thumbnail(url=repo['avatar_url'])
-
-                await wait_for_deletion(message, self.bot, embed, True)
-
-            await message.edit(suppress=True)
+        if gh_match or gl_match:
+            await jobs.run(guild_key(message), lambda: self.send_widgets(message))
+
+    async def send_widgets(self, message):
+        """Sends an embed for each repo link in message"""
+
+        for gh in GITHUB_RE.finditer(message.content):
+            d = gh.groupdict()
+            headers = {}
+            if 'GITHUB_TOKEN' in os.environ:
+                headers['Authorization'] = f'token {os.environ["GITHUB_TOKEN"]}'
+            repo = await fetch_http(
+                self.session,
+                f'https://api.github.com/repos/{d["owner"]}/{d["repo"]}',
+                'json',
+                cache=widget_cache,
+                parse=lambda repo: pick(repo, GITHUB_FIELDS),
+                measure=sizeof,
+                headers=headers,
+                priority=WIDGET,
+            )
+
+            embed = discord.Embed(
+                title=repo['full_name'],
+                description='No description provided' if repo[
+                    'description'] is None else repo['description'],
+                url=repo['html_url'],
+                color=0x111111
+            ).set_footer(
+                text=f'Language: {repo["language"]} | ' +
+                     f'Stars: {repo["stargazers_count"]} | ' +
+                     f'Forks: {repo["forks_count"]} | ' +
+                     f'Size: {repo["size"]}kb'
+            ).set_thumbnail(url=repo['owner']['avatar_url'])
+            if repo['homepage']:
+                embed.add_field(name='Website', value=repo['homepage'])
+            await message.channel.send(embed=embed)
+
+        for gl in GITLAB_RE.finditer(message.content):
+            d = gl.groupdict()
+            headers = {}
+            if 'GITLAB_TOKEN' in os.environ:
+                headers['PRIVATE-TOKEN'] = os.environ["GITLAB_TOKEN"]
+            repo = await fetch_http(
+                self.session,
+                f'https://gitlab.com/api/v4/projects/{quote_plus(d["owner"])}%2F{quote_plus(d["repo"])}',
+                'json',
+                cache=widget_cache,
+                parse=lambda repo: pick(repo, GITLAB_FIELDS),
+                measure=sizeof,
+                headers=headers,
+                priority=WIDGET,
+            )
+
+            embed = discord.Embed(
+                title=repo['path_with_namespace'],
+                description='No description provided' if repo[
+                    'description'] == "" else repo['description'],
+                url=repo['web_url'],
+                color=0x111111
+            ).set_footer(
+                text=f'Stars: {repo["star_count"]} | ' +
+                     f'Forks: {repo["forks_count"]}'
+            )
+
+            if repo['avatar_url'] is not None:
+                embed.set_thumbnail(url=repo['avatar_url'])
+
+            await wait_for_deletion(message, self.bot, embed, True)
+
+        # The GitHub embeds are sent without wait_for_deletion, so the links' own embeds are suppressed here
+        await suppress_embeds(message)
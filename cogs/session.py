@@ -0,0 +1,103 @@
+"""
+Creates the aiohttp session shared by all the cogs
+
+The connector keeps connections to the APIs alive between bursts of
+links and caches DNS lookups, and every request gets a timeout so a hung
+upstream can't hold a snippet forever
+"""
+
+import os
+
+import aiohttp
+
+# Counts of connections opened vs. reused from the pool
+connection_stats = {'created': 0, 'reused': 0}
+
+
+async def on_connection_create_end(session, context, params):
+    connection_stats['created'] += 1
+
+
+async def on_connection_reuseconn(session, context, params):
+    connection_stats['reused'] += 1
+
+
+def create_session():
+    """Creates an aiohttp session configured from environment variables"""
+
+    connector = aiohttp.TCPConnector(
+        limit=int(os.environ.get('HTTP_LIMIT', 100)),
+        limit_per_host=int(os.environ.get('HTTP_LIMIT_PER_HOST', 20)),
+        # api.github.com and gitlab.com both keep idle connections open for at least a minute
+        keepalive_timeout=float(os.environ.get('HTTP_KEEPALIVE', 60)),
+        ttl_dns_cache=int(os.environ.get('DNS_CACHE_TTL', 300)),
+        enable_cleanup_closed=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=float(os.environ.get('HTTP_TIMEOUT', 30)),
+        connect=float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5)),
+        sock_read=float(os.environ.get('HTTP_READ_TIMEOUT', 10)),
+    )
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[trace_config])
+
+
+def pool_stats(session):
+    """Returns how many of the session's connections are in use or idle, overall and per host"""
+
+    connector = session.connector
+    # aiohttp doesn't expose these publicly, so fall back to empty if they move
+    acquired_per_host = getattr(connector, '_acquired_per_host', {})
+    idle_per_host = getattr(connector, '_conns', {})
+
+    hosts = {}
+    for key in set(acquired_per_host) | set(idle_per_host):
+        hosts[f'{key.host}:{key.port}'] = {
+            'in_use': len(acquired_per_host.get(key, ())),
+            'idle': len(idle_per_host.get(key, ())),
+        }
+
+    return {
+        'limit': connector.limit,
+        'limit_per_host': connector.limit_per_host,
+        'in_use': len(getattr(connector, '_acquired', ())),
+        'idle': sum(host['idle'] for host in hosts.values()),
+        'created': connection_stats['created'],
+        'reused': connection_stats['reused'],
+        'hosts': hosts,
+    }
+
+
+def pool_metrics(session):
+    """Returns pool_stats(session) as metrics gauges, for registering with cogs.metrics.collector"""
+
+    stats = pool_stats(session)
+    return [
+        (
+            'gitthelines_http_connections',
+            'Pooled connections by state',
+            {(('state', 'in_use'),): stats['in_use'], (('state', 'idle'),): stats['idle']},
+        ),
+        (
+            'gitthelines_http_host_connections',
+            'Pooled connections by host and state',
+            {
+                (('host', host), ('state', state)): counts[state]
+                for host, counts in stats['hosts'].items() for state in ['in_use', 'idle']
+            },
+        ),
+        (
+            'gitthelines_http_connections_opened',
+            'Connections opened, and times an idle connection was reused instead',
+            {(('kind', 'created'),): stats['created'], (('kind', 'reused'),): stats['reused']},
+        ),
+        (
+            'gitthelines_http_connection_limit',
+            'Most connections the pool allows, overall and per host',
+            {(('scope', 'total'),): stats['limit'], (('scope', 'per_host'),): stats['limit_per_host']},
+        ),
+    ]
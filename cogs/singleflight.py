@@ -0,0 +1,54 @@
+"""
+Coalesces identical in-flight requests
+
+When the same link is posted several times at once, only the first
+request goes out and the others wait for its result
+"""
+
+import asyncio
+
+
+class SingleFlight:
+    def __init__(self):
+        # Maps a key to [task, number of callers waiting on it]
+        self.calls = {}
+        self.started = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self.calls)
+
+    async def do(self, key, func):
+        """
+        Returns the result of func(), sharing a single call among
+        concurrent callers with the same key
+
+        A caller being cancelled doesn't cancel the shared call unless
+        it was the last one waiting on it
+        """
+
+        call = self.calls.get(key)
+        if call is None:
+            call = [asyncio.ensure_future(func()), 0]
+            self.calls[key] = call
+            self.started += 1
+
+            def forget(_, call=call):
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+
+            call[0].add_done_callback(forget)
+        else:
+            self.shared += 1
+
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                # Everyone waiting was cancelled, so nobody needs the result
+                call[0].cancel()
+
+    def stats(self):
+        return {'in_flight': len(self.calls), 'started': self.started, 'shared': self.shared}
@@ -1,19 +1,71 @@
+import asyncio
+import logging
 import os
 
-import dbl
+import aiohttp
 from discord.ext.commands import Cog
 
+from cogs.coordinator import cluster_stats
+
+# Seconds between posts, as dblpy's autopost does
+POST_INTERVAL = 1800
+# Seconds to wait for every worker's guild count before trying again
+RETRY_INTERVAL = 60
+
+log = logging.getLogger(__name__)
+
 
 class TopGG(Cog):
     """Handles interactions with the top.gg API"""
 
-    def __init__(self, bot):
-        """Sets the bot and top.gg tokens"""
+    def __init__(self, bot, session):
+        """Sets the bot, session and top.gg token"""
 
         self.bot = bot
+        self.session = session
         self.token = os.environ['TOP_GG_TOKEN']
-        self.dblpy = dbl.DBLClient(self.bot, self.token, autopost=True)
+        self.poster = asyncio.ensure_future(self.post_guild_count())
+
+    def guild_count(self):
+        """
+        Returns the bot's guild count, which is the total over every worker
+        when run by launcher.py, or None if a worker hasn't reported one yet
+        """
+
+        if 'COORDINATOR_PORT' in os.environ:
+            return cluster_stats['guilds']
+        return len(self.bot.guilds)
+
+    async def post_guild_count(self):
+        """
+        Posts the guild count every POST_INTERVAL seconds
+
+        Posted directly rather than through dblpy, whose post_guild_count
+        always sends the guild count of this process
+        """
+
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            guild_count = self.guild_count()
+            if guild_count is None:
+                await asyncio.sleep(RETRY_INTERVAL)
+                continue
+
+            try:
+                async with self.session.post(
+                    f'https://top.gg/api/bots/{self.bot.user.id}/stats',
+                    json={'server_count': guild_count},
+                    headers={'Authorization': self.token},
+                ) as response:
+                    response.raise_for_status()
+                self.bot.dispatch('guild_post')
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                log.warning('Failed to post the server count to top.gg')
+            await asyncio.sleep(POST_INTERVAL)
 
     @Cog.listener()
     async def on_guild_post(self):
         print("Server count posted successfully")
+
+    def cog_unload(self):
+        self.poster.cancel()
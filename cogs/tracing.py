@@ -0,0 +1,137 @@
+"""
+Sampled per-message traces
+
+When TRACE_SAMPLE_RATE is above 0, that fraction of messages get a trace
+recording when each step of handling them started and how long it took.
+Traces slower than TRACE_SLOW_SECONDS are appended to a rotating log file,
+and the most recent traces are kept in memory for the trace command
+"""
+
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+SLOW_SECONDS = float(os.environ.get('TRACE_SLOW_SECONDS', 1))
+TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.log')
+TRACE_FILE_BYTES = int(os.environ.get('TRACE_FILE_BYTES', 10 * 1024 * 1024))
+TRACE_FILE_BACKUPS = int(os.environ.get('TRACE_FILE_BACKUPS', 3))
+
+current_trace = ContextVar('current_trace', default=None)
+current_depth = ContextVar('current_depth', default=0)
+
+recent_traces = deque(maxlen=int(os.environ.get('TRACE_RECENT', 200)))
+
+slow_log = logging.getLogger('gitthelines.traces')
+slow_log.propagate = False
+
+
+class Trace:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.started = time.time()
+        self.start_time = time.perf_counter()
+        self.duration = None
+        # (name, labels, depth, seconds after the trace started, duration)
+        self.spans = []
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start_time
+        self.spans.sort(key=lambda recorded: recorded[3])
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'labels': self.labels,
+            'started': datetime.fromtimestamp(self.started).isoformat(),
+            'duration': self.duration,
+            'spans': [
+                {'name': name, 'labels': labels, 'depth': depth, 'offset': offset, 'duration': duration}
+                for name, labels, depth, offset, duration in self.spans
+            ],
+        }
+
+    def format(self):
+        """Formats the trace as an indented list of spans, for sending in a code block"""
+
+        lines = [f'{self.duration * 1000:8.1f}ms  {self.name} {format_labels(self.labels)}'.rstrip()]
+        for name, labels, depth, offset, duration in self.spans:
+            lines.append(
+                f'{duration * 1000:8.1f}ms  {"  " * (depth + 1)}{name} {format_labels(labels)}'
+                f' (+{offset * 1000:.1f}ms)'
+            )
+        return '\n'.join(lines)
+
+
+def format_labels(labels):
+    return ' '.join(f'{name}={value}' for name, value in labels.items())
+
+
+@contextmanager
+def trace(name, sample_rate=None, **labels):
+    """
+    Starts a trace with the given probability (TRACE_SAMPLE_RATE by
+    default), which spans opened inside the with statement are recorded to
+    """
+
+    if random.random() >= (SAMPLE_RATE if sample_rate is None else sample_rate):
+        yield None
+        return
+
+    new_trace = Trace(name, labels)
+    token = current_trace.set(new_trace)
+    try:
+        yield new_trace
+    finally:
+        current_trace.reset(token)
+        new_trace.finish()
+        record(new_trace)
+
+
+@contextmanager
+def span(name, **labels):
+    """
+    Records how long the body of the with statement takes to the current
+    trace, if there is one
+
+    Yields the span's labels, so labels only known at the end can be added
+    """
+
+    parent = current_trace.get()
+    if parent is None:
+        yield labels
+        return
+
+    depth = current_depth.get()
+    token = current_depth.set(depth + 1)
+    start_time = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        current_depth.reset(token)
+        parent.spans.append((name, labels, depth, start_time - parent.start_time, time.perf_counter() - start_time))
+
+
+def record(finished_trace):
+    recent_traces.append(finished_trace)
+    if finished_trace.duration < SLOW_SECONDS:
+        return
+
+    if not slow_log.handlers:
+        slow_log.setLevel(logging.INFO)
+        slow_log.addHandler(RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_FILE_BYTES, backupCount=TRACE_FILE_BACKUPS))
+    slow_log.info(json.dumps(finished_trace.to_dict(), default=str))
+
+
+def slowest_traces(count):
+    """Returns the count slowest of the recent traces, slowest first"""
+
+    return sorted(recent_traces, key=lambda recent: recent.duration, reverse=True)[:count]
@@ -1,75 +1,578 @@
 import asyncio
+import codecs
+import logging
 import os
-import textwrap
-from urllib.parse import quote_plus
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from os.path import commonprefix
+from urllib.parse import quote_plus, urlsplit
+
+import aiohttp
+import discord
+
+from cogs.cache import Blob, LRUCache, is_commit_sha
+from cogs.delete_reactions import DELETE_EMOJI
+from cogs.disk_cache import DiskCache
+from cogs.metrics import (collector, endpoint, file_fetch_seconds, ref_resolution_seconds, reply_seconds,
+                          upstream_requests, upstream_seconds)
+from cogs.ratelimit import SNIPPET, Scheduler
+from cogs.refs import RefTrie
+from cogs.singleflight import SingleFlight
+from cogs.tracing import span
+
+log = logging.getLogger(__name__)
+
+# Keyed on (host, repo, ref, path). Files at a commit SHA never change, so they are kept longer
+file_cache = LRUCache(
+    max_bytes=int(os.environ.get('CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    ttl=int(os.environ.get('CACHE_TTL', 300)),
+    immutable_ttl=int(os.environ.get('CACHE_IMMUTABLE_TTL', 24 * 60 * 60)),
+)
+
+# Keyed on (gist_id, revision), holds the files in each gist as returned by gist_files
+gist_cache = LRUCache(
+    max_bytes=int(os.environ.get('GIST_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+    ttl=int(os.environ.get('CACHE_TTL', 300)),
+    immutable_ttl=int(os.environ.get('CACHE_IMMUTABLE_TTL', 24 * 60 * 60)),
+)
+
+# Keyed on API URL, holds the fields the repo, commit and pull request widgets
+# show. Commits at a full SHA never change, so they're kept until evicted
+widget_cache = LRUCache(
+    max_bytes=int(os.environ.get('WIDGET_CACHE_MAX_BYTES', 4 * 1024 * 1024)),
+    ttl=int(os.environ.get('WIDGET_CACHE_TTL', 60)),
+    immutable_ttl=float('inf'),
+)
+
+# Keyed on (content hash, content length, path, start line, end line), holds rendered code blocks.
+# The key changes whenever the content does, so entries never go stale
+render_cache = LRUCache(
+    max_bytes=int(os.environ.get('RENDER_CACHE_MAX_BYTES', 4 * 1024 * 1024)),
+    ttl=float('inf'),
+)
+
+# Renders that have to split or index more than this many characters run on
+# render_executor, so a huge file can't hold up the event loop and with it the
+# gateway heartbeat. A thread rather than a process, so line indexes are built
+# in place on the cached Blob instead of the whole file being copied over. The
+# work holds the GIL, so more threads would only make the loop wait longer for it
+RENDER_EXECUTOR_CHARS = int(os.environ.get('RENDER_EXECUTOR_CHARS', 256 * 1024))
+render_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('RENDER_WORKERS', 1)))
+
+# Optional tier under file_cache that survives restarts
+disk_cache = None
+if 'DISK_CACHE_PATH' in os.environ:
+    disk_cache = DiskCache(
+        os.environ['DISK_CACHE_PATH'],
+        max_bytes=int(os.environ.get('DISK_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+    )
+
+# Keyed on (host, repo), holds a RefTrie of the repo's branches and tags
+ref_indexes = LRUCache(
+    max_bytes=int(os.environ.get('REF_CACHE_MAX_BYTES', 4 * 1024 * 1024)),
+    ttl=int(os.environ.get('REF_CACHE_TTL', 600)),
+)
+
+# Paces requests to the GitHub and GitLab APIs
+scheduler = Scheduler(
+    rate=float(os.environ.get('RATE_LIMIT_RPS', 10)),
+    burst=int(os.environ.get('RATE_LIMIT_BURST', 20)),
+    max_wait=float(os.environ.get('RATE_LIMIT_MAX_WAIT', 10)),
+    max_queue=int(os.environ.get('RATE_LIMIT_MAX_QUEUE', 100)),
+)
+
+# Shares in-flight requests between concurrent identical fetches
+flights = SingleFlight()
+
+# Keyed on message ID, remembers messages whose embeds were suppressed so
+# cogs replying to the same message don't each edit it, along with how many
+# replies to them were sent. Every entry has size 1, so max_bytes is the
+# number of messages remembered
+suppressed_messages = LRUCache(max_bytes=10000, ttl=300)
+
+# Files are never read past this many bytes
+MAX_FILE_BYTES = int(os.environ.get('MAX_FILE_BYTES', 8 * 1024 * 1024))
+
+# Ranged fetches start with a prefix of max(RANGE_MIN_BYTES, end_line * RANGE_LINE_BYTES) bytes
+RANGE_MIN_BYTES = int(os.environ.get('RANGE_MIN_BYTES', 16 * 1024))
+RANGE_LINE_BYTES = 64
+
+# Counts of file requests, how many were ranged or answered 304, and the bytes downloaded
+transfer_stats = {'files': 0, 'ranged_files': 0, 'revalidated': 0, 'bytes': 0}
+
+
+@collector
+def cache_metrics():
+    """Exposes the caches', scheduler's and downloads' own counters as metrics"""
+
+    caches = {
+        'file': file_cache, 'ref': ref_indexes, 'gist': gist_cache, 'render': render_cache, 'widget': widget_cache,
+    }
+    if disk_cache is not None:
+        caches['disk'] = disk_cache
+
+    gauges = []
+    for stat in ['hits', 'misses', 'evictions']:
+        gauges.append((
+            f'gitthelines_cache_{stat}',
+            f'Cache {stat} by cache',
+            {(('cache', name),): getattr(cache, stat) for name, cache in caches.items()},
+        ))
+    gauges.append((
+        'gitthelines_cache_hit_ratio',
+        'Fraction of cache lookups that were hits',
+        {(('cache', name),): cache.hits / max(1, cache.hits + cache.misses) for name, cache in caches.items()},
+    ))
+    gauges.append((
+        'gitthelines_cache_bytes',
+        'Bytes held by each in-memory cache',
+        {(('cache', name),): cache.total_bytes for name, cache in caches.items() if name != 'disk'},
+    ))
+    gauges.append((
+        'gitthelines_file_downloads',
+        'File requests by kind',
+        {(('kind', kind),): transfer_stats[kind] for kind in ['files', 'ranged_files', 'revalidated']},
+    ))
+    gauges.append(('gitthelines_downloaded_bytes', 'Bytes of file bodies downloaded', {(): transfer_stats['bytes']}))
+
+    budgets = scheduler.stats()
+    gauges.append((
+        'gitthelines_rate_limit_queued',
+        'Requests waiting on each rate limit budget',
+        {(('budget', name),): budget['queued'] for name, budget in budgets.items()},
+    ))
+    gauges.append((
+        'gitthelines_rate_limit_remaining',
+        'Quota left as last reported by the API',
+        {(('budget', name),): budget['remaining'] for name, budget in budgets.items()
+         if budget['remaining'] is not None},
+    ))
+    return gauges
+
+
+class FileTooLarge(Exception):
+    """Raised when the requested lines of a file are past MAX_FILE_BYTES"""
+
+
+def conditional_headers(headers, etag, last_modified):
+    """Adds the headers that make a request conditional on the cached validators"""
+
+    headers = dict(headers or {})
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+@asynccontextmanager
+async def request(session, url, priority=SNIPPET, **kwargs):
+    """
+    Makes a GET request once the host's rate limit budget allows it,
+    raising RateLimitExceeded if it can't be sent in time
+    """
+
+    host = urlsplit(url).hostname
+    budget = scheduler.budget(url, kwargs.get('headers'))
+    if budget is not None:
+        with span('rate_limit_wait', host=host):
+            await budget.acquire(priority)
+
+    start_time = time.perf_counter()
+    # The span also covers the caller reading the body
+    with span('http', host=host, endpoint=endpoint(url)) as labels:
+        async with session.get(url, **kwargs) as response:
+            labels['status'] = response.status
+            upstream_seconds.observe(time.perf_counter() - start_time, host=host)
+            upstream_requests.inc(host=host, endpoint=endpoint(url), status=response.status)
+            if budget is not None:
+                budget.update(response.headers, response.status)
+            yield response
+
+
+def headers_key(headers):
+    """Returns a hashable version of a request's headers, which include its auth"""
+
+    return tuple(sorted((headers or {}).items()))
 
 
 async def fetch_http(session, url, response_format='text', **kwargs):
-    """Uses aiohttp to make http GET requests"""
+    """
+    Uses aiohttp to make http GET requests
+
+    Concurrent requests for the same URL with the same headers share a
+    single request. Takes the same arguments as download_http
+    """
+
+    return await flights.do(
+        ('http', url, response_format, headers_key(kwargs.get('headers'))),
+        lambda: download_http(session, url, response_format, **kwargs),
+    )
 
-    async with session.get(url, **kwargs) as response:
+
+async def download_http(session, url, response_format='text', cache=None, key=None, immutable=False,
+                        priority=SNIPPET, parse=None, measure=None, **kwargs):
+    """
+    Makes an http GET request
+
+    If cache is given, responses are stored in it under key (the url by
+    default), and stale entries are revalidated with conditional requests.
+    If parse is given, it's applied to the response before it's cached.
+    Entries take up the size of the response in the cache, or measure(value)
+    if measure is given
+    """
+
+    cached = None
+    if cache is not None:
+        key = url if key is None else key
+        cached, fresh = cache.lookup(key)
+        if fresh:
+            return cached[0]
+        if cached is not None:
+            kwargs['headers'] = conditional_headers(kwargs.get('headers'), cached[1], cached[2])
+
+    async with request(session, url, priority, **kwargs) as response:
+        if response.status == 304 and cached is not None:
+            cache.set(key, cached, immutable=immutable, size=cached[3])
+            return cached[0]
+        response.raise_for_status()
+
+        size = len(await response.read())
+        value = None
         if response_format == 'text':
-            return await response.text()
+            value = await response.text()
         elif response_format == 'json':
-            return await response.json()
+            value = await response.json()
+        if parse is not None:
+            value = parse(value)
+        if measure is not None:
+            size = measure(value)
+
+        if cache is not None:
+            cache.set(
+                key,
+                (value, response.headers.get('ETag'), response.headers.get('Last-Modified'), size),
+                immutable=immutable,
+                size=size,
+            )
+        return value
+
+
+def response_blob(response, text, complete):
+    """Creates a Blob that remembers the response's cache validators"""
+
+    return Blob(text, complete, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+
+async def read_lines(response, end_line=None, max_bytes=MAX_FILE_BYTES):
+    """Reads and decodes a response body into a Blob until it contains line end_line"""
+
+    decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')(errors='replace')
+    chunks = []
+    newlines = 0
+    size = 0
+
+    async for chunk in response.content.iter_any():
+        transfer_stats['bytes'] += len(chunk)
+        too_large = size + len(chunk) > max_bytes
+        # Only lines within max_bytes count, even if more arrived in the same chunk
+        chunk = chunk[:max_bytes - size]
+        size += len(chunk)
+
+        text = decoder.decode(chunk)
+        chunks.append(text)
+        newlines += text.count('\n')
+        if end_line is not None and newlines >= end_line:
+            # Closing the response early stops the rest of the download
+            response.close()
+            return response_blob(response, ''.join(chunks), False)
+        if too_large:
+            raise FileTooLarge(response.url)
+
+    chunks.append(decoder.decode(b'', final=True))
+    return response_blob(response, ''.join(chunks), True)
+
+
+async def read_range(session, url, end_line, headers=None, **kwargs):
+    """
+    Reads a prefix of a file containing line end_line into a Blob using Range requests
+
+    Starts with a prefix estimated from end_line and doubles it until
+    enough newlines have been read. Falls back to reading the whole file
+    if the server ignores Range, or if the file changes between requests,
+    so the Blob never joins parts of two versions. Returns None if the
+    first request was conditional and the server answered 304 Not Modified
+    """
+
+    headers = dict(headers or {})
+    body = bytearray()
+    newlines = 0
+    size = min(max(RANGE_MIN_BYTES, end_line * RANGE_LINE_BYTES), MAX_FILE_BYTES)
+    charset = 'utf-8'
+    etag = last_modified = None
+
+    while True:
+        headers['Range'] = f'bytes={len(body)}-{size - 1}'
+        async with request(session, url, headers=headers, **kwargs) as response:
+            if response.status == 304:
+                return None
+            if response.status == 416:
+                # The previous range ended exactly at the end of the file
+                complete = True
+                break
+            response.raise_for_status()
+            if response.status != 206:
+                # The server ignored Range, or If-Range found the file had
+                # changed, and is sending the whole current version
+                return await read_lines(response, end_line)
+
+            changed = bool(body) and response.headers.get('ETag', etag) != etag
+            if not changed:
+                charset = response.charset or charset
+                etag = response.headers.get('ETag', etag)
+                last_modified = response.headers.get('Last-Modified', last_modified)
+                chunk = await response.read()
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+
+        if changed:
+            # The server didn't honour If-Range, so start over with the whole file
+            headers.pop('Range')
+            headers.pop('If-Range', None)
+            async with request(session, url, headers=headers, **kwargs) as response:
+                response.raise_for_status()
+                return await read_lines(response, end_line)
+
+        # Only the first request is conditional. The rest are only answered
+        # with a range if the file is still the version the first one read
+        headers.pop('If-None-Match', None)
+        headers.pop('If-Modified-Since', None)
+        if etag is not None or last_modified is not None:
+            headers['If-Range'] = etag if etag is not None else last_modified
+
+        transfer_stats['bytes'] += len(chunk)
+        body += chunk
+        newlines += chunk.count(b'\n')
+
+        complete = not chunk or (total.isdigit() and len(body) >= int(total))
+        if complete or newlines >= end_line:
+            break
+        if size >= MAX_FILE_BYTES:
+            raise FileTooLarge(url)
+        size = min(size * 2, MAX_FILE_BYTES)
+
+    return Blob(body.decode(charset, errors='replace'), complete, etag, last_modified)
+
+
+async def fetch_file(session, key, url, end_line=None, ranged=False, headers=None, **kwargs):
+    """
+    Fetches a Blob of a file up to line end_line (or the whole file if
+    end_line is None), going through the file cache
+
+    Concurrent fetches of the same lines of the same file share a single
+    download
+    """
+
+    with span('fetch_file', host=key[0], end_line=end_line), file_fetch_seconds.time(host=key[0]):
+        return await flights.do(
+            ('file', key, end_line, headers_key(headers)),
+            lambda: download_file(session, key, url, end_line, ranged, headers, **kwargs),
+        )
+
+
+async def download_file(session, key, url, end_line=None, ranged=False, headers=None, **kwargs):
+    """
+    Downloads the text of a file up to line end_line into the file cache,
+    unless the cache already has it
+
+    Stale cached files are revalidated with a conditional request rather
+    than downloaded again. If ranged is True, the server is asked for just
+    a prefix of the file
+    """
+
+    immutable = is_commit_sha(key[2])
+
+    cached, fresh = file_cache.lookup(key)
+    if (cached is None or not cached.has_lines(end_line)) and disk_cache is not None:
+        disk_blob, ttl = await disk_cache.get(key)
+        if disk_blob is not None and disk_blob.has_lines(end_line):
+            file_cache.set(key, disk_blob, size=disk_blob.size, ttl=max(0, ttl))
+            cached, fresh = disk_blob, ttl > 0
+
+    if cached is not None and cached.has_lines(end_line):
+        if fresh:
+            return cached
+        if cached.etag is not None or cached.last_modified is not None:
+            headers = conditional_headers(headers, cached.etag, cached.last_modified)
+        else:
+            cached = None
+    else:
+        cached = None
 
+    transfer_stats['files'] += 1
+    if ranged and end_line is not None:
+        transfer_stats['ranged_files'] += 1
+        blob = await read_range(session, url, end_line, headers=headers, **kwargs)
+    else:
+        async with request(session, url, headers=headers, **kwargs) as response:
+            if response.status == 304:
+                blob = None
+            else:
+                response.raise_for_status()
+                blob = await read_lines(response, end_line)
+
+    if blob is None:
+        # 304 Not Modified, so the cached copy is still good
+        transfer_stats['revalidated'] += 1
+        blob = cached
+    file_cache.set(key, blob, immutable=immutable, size=blob.size)
+    if disk_cache is not None:
+        ttl = file_cache.immutable_ttl if immutable else file_cache.ttl
+        # Nothing waits on the write, so it doesn't slow down the reply
+        asyncio.ensure_future(disk_cache.set(key, blob, ttl, immutable))
+    return blob
+
+
+async def warm_up_cache(limit=int(os.environ.get('CACHE_WARM_UP_ENTRIES', 500))):
+    """Loads the most used files from the disk cache into memory"""
+
+    if disk_cache is None:
+        return
 
-async def fetch_github_snippet(session, repo, path, start_line, end_line):
+    for key, blob, ttl, immutable in await disk_cache.hottest(limit):
+        # Entries that went stale while the bot was down get revalidated on first use
+        file_cache.set(key, blob, immutable=immutable, size=blob.size, ttl=max(0, ttl))
+
+
+def last_line(start_line, end_line):
+    """Returns the last line a snippet link needs, or None if it needs the whole file"""
+
+    if start_line is None:
+        return None
+    if end_line is None:
+        return int(start_line)
+    return max(int(start_line), int(end_line))
+
+
+async def fetch_ref_file(session, host, repo, path, ref_urls, file_url, end_line=None, **kwargs):
+    """
+    Splits path into a ref and a file path, then fetches that file
+
+    Tries the first segment of path as the ref before listing the repo's
+    refs, since most links point at a branch without slashes in its name.
+    file_url(ref, file_path) builds the URL of the file at a given ref
+    """
+
+    refs = ref_indexes.get((host, repo))
+    if refs is None:
+        ref, _, file_path = path.partition('/')
+        try:
+            file_contents = await fetch_file(
+                session, (host, repo, ref, file_path), file_url(ref, file_path), end_line, **kwargs)
+            return file_path, file_contents
+        except aiohttp.ClientResponseError as error:
+            if error.status != 404:
+                raise
+
+        with span('list_refs', host=host), ref_resolution_seconds.time(host=host):
+            ref_lists = await asyncio.gather(*(fetch_http(session, url, 'json', **kwargs) for url in ref_urls))
+        refs = RefTrie(possible_ref['name'] for ref_list in ref_lists for possible_ref in ref_list)
+        ref_indexes.set((host, repo), refs, size=refs.size)
+
+    ref, file_path = refs.split(path)
+    file_contents = await fetch_file(
+        session, (host, repo, ref, file_path), file_url(ref, file_path), end_line, **kwargs)
+    return file_path, file_contents
+
+
+async def fetch_github_snippet(session, repo, path, start_line, end_line, max_chars=None):
     """Fetches a snippet from a github repo"""
 
     headers = {'Accept': 'application/vnd.github.v3.raw'}
     if "GITHUB_TOKEN" in os.environ:
         headers['Authorization'] = f'token {os.environ["GITHUB_TOKEN"]}'
 
-    refs = (await fetch_http(session, f'https://api.github.com/repos/{repo}/branches', 'json', headers=headers) +
-            await fetch_http(session, f'https://api.github.com/repos/{repo}/tags', 'json', headers=headers))
-
-    ref = path.split('/')[0]
-    file_path = '/'.join(path.split('/')[1:])
-    for possible_ref in refs:
-        if path.startswith(possible_ref['name'] + '/'):
-            ref = possible_ref['name']
-            file_path = path[len(ref) + 1:]
-            break
-
-    file_contents = await fetch_http(
+    file_path, file_contents = await fetch_ref_file(
         session,
-        f'https://api.github.com/repos/{repo}/contents/{file_path}?ref={ref}',
-        'text',
+        'github.com',
+        repo,
+        path,
+        [f'https://api.github.com/repos/{repo}/branches?per_page=100',
+         f'https://api.github.com/repos/{repo}/tags?per_page=100'],
+        lambda ref, file_path: f'https://api.github.com/repos/{repo}/contents/{file_path}?ref={ref}',
+        last_line(start_line, end_line),
         headers=headers,
     )
 
-    return await snippet_to_embed(file_contents, file_path, start_line, end_line)
+    return await snippet_to_embed(file_contents, file_path, start_line, end_line, max_chars)
+
+
+def pick(value, fields):
+    """
+    Copies just the given fields of a JSON object, so the rest of it doesn't
+    take up cache space
+
+    fields maps each key to None to keep its value whole, or to the fields to
+    pick from it in turn. Missing keys raise KeyError, and null values are kept
+    """
+
+    return {
+        key: value[key] if subfields is None or value[key] is None else pick(value[key], subfields)
+        for key, subfields in fields.items()
+    }
 
 
-async def fetch_github_gist_snippet(session, gist_id, revision, file_path, start_line, end_line):
+def gist_files(gist_json):
+    """
+    Maps the slugs gist links use for each file to the file's name, raw URL,
+    and contents if the gist API didn't truncate them
+    """
+
+    files = {}
+    for name, gist_file in gist_json['files'].items():
+        contents = None
+        if not gist_file.get('truncated', True) and gist_file.get('content') is not None:
+            contents = Blob(gist_file['content'])
+        files.setdefault(name.lower().replace('.', '-'), (name, gist_file['raw_url'], contents))
+    return files
+
+
+async def fetch_github_gist_snippet(session, gist_id, revision, file_path, start_line, end_line, max_chars=None):
     """Fetches a snippet from a gist"""
 
     headers = {'Accept': 'application/vnd.github.v3.raw'}
     if "GITHUB_TOKEN" in os.environ:
         headers['Authorization'] = f'token {os.environ["GITHUB_TOKEN"]}'
 
-    gist_json = await fetch_http(
+    files = await fetch_http(
         session,
         f'https://api.github.com/gists/{gist_id}{f"/{revision}" if len(revision) > 0 else ""}',
         'json',
+        cache=gist_cache,
+        key=(gist_id, revision),
+        # A gist at a specific revision can never change
+        immutable=is_commit_sha(revision),
+        parse=gist_files,
         headers=headers,
     )
 
-    for gist_file in gist_json['files']:
-        if file_path == gist_file.lower().replace('.', '-'):
-            file_contents = await fetch_http(
-                session,
-                gist_json['files'][gist_file]['raw_url'],
-                'text',
-            )
+    if file_path not in files:
+        return ''
 
-            return await snippet_to_embed(file_contents, gist_file, start_line, end_line)
+    gist_file, raw_url, file_contents = files[file_path]
+    if file_contents is None:
+        file_contents = await fetch_file(
+            session,
+            ('gist.github.com', gist_id, revision, gist_file),
+            raw_url,
+            last_line(start_line, end_line),
+            ranged=True,
+        )
 
-    return ''
+    return await snippet_to_embed(file_contents, gist_file, start_line, end_line, max_chars)
 
 
-async def fetch_gitlab_snippet(session, repo, path, start_line, end_line):
+async def fetch_gitlab_snippet(session, repo, path, start_line, end_line, max_chars=None):
     """Fetches a snippet from a gitlab repo"""
 
     headers = {}
@@ -78,60 +581,98 @@ async def fetch_gitlab_snippet(session, repo, path, start_line, end_line):
 
     enc_repo = quote_plus(repo)
 
-    refs = (await fetch_http(session, f'https://gitlab.com/api/v4/projects/{enc_repo}/repository/branches', 'json', headers=headers) +
-            await fetch_http(session, f'https://gitlab.com/api/v4/projects/{enc_repo}/repository/tags', 'json', headers=headers))
-
-    ref = path.split('/')[0]
-    file_path = '/'.join(path.split('/')[1:])
-    for possible_ref in refs:
-        if path.startswith(possible_ref['name'] + '/'):
-            ref = possible_ref['name']
-            file_path = path[len(ref) + 1:]
-            break
-
-    enc_ref = quote_plus(ref)
-    enc_file_path = quote_plus(file_path)
-
-    file_contents = await fetch_http(
+    file_path, file_contents = await fetch_ref_file(
         session,
-        f'https://gitlab.com/api/v4/projects/{enc_repo}/repository/files/{enc_file_path}/raw?ref={enc_ref}',
-        'text',
+        'gitlab.com',
+        repo,
+        path,
+        [f'https://gitlab.com/api/v4/projects/{enc_repo}/repository/branches?per_page=100',
+         f'https://gitlab.com/api/v4/projects/{enc_repo}/repository/tags?per_page=100'],
+        lambda ref, file_path: (f'https://gitlab.com/api/v4/projects/{enc_repo}/repository/files/'
+                                f'{quote_plus(file_path)}/raw?ref={quote_plus(ref)}'),
+        last_line(start_line, end_line),
         headers=headers,
     )
 
-    return await snippet_to_embed(file_contents, file_path, start_line, end_line)
+    return await snippet_to_embed(file_contents, file_path, start_line, end_line, max_chars)
 
 
-async def fetch_bitbucket_snippet(session, repo, ref, file_path, start_line, end_line):
+async def fetch_bitbucket_snippet(session, repo, ref, file_path, start_line, end_line, max_chars=None):
     """Fetches a snippet from a bitbucket repo"""
 
-    file_contents = await fetch_http(
+    file_contents = await fetch_file(
         session,
+        ('bitbucket.org', repo, ref, file_path),
         f'https://bitbucket.org/{quote_plus(repo)}/raw/{quote_plus(ref)}/{quote_plus(file_path)}',
-        'text',
+        last_line(start_line, end_line),
+        ranged=True,
     )
 
-    return await snippet_to_embed(file_contents, file_path, start_line, end_line)
+    return await snippet_to_embed(file_contents, file_path, start_line, end_line, max_chars)
 
 
-async def fetch_heptapod_snippet(session, repo, path, start_line, end_line):
-    file_contents = await fetch_http(
+async def fetch_heptapod_snippet(session, repo, path, start_line, end_line, max_chars=None):
+    ref = path.split('/')[0]
+    file_path = '/'.join(path.split('/')[1:])
+
+    file_contents = await fetch_file(
         session,
+        ('foss.heptapod.net', repo, ref, file_path),
         f'https://foss.heptapod.net/{repo}/-/raw/branch/{path}',
-        'text',
+        last_line(start_line, end_line),
+        ranged=True,
     )
 
-    file_path = '/'.join(path.split('/')[1:])
-    return await snippet_to_embed(file_contents, file_path, start_line, end_line)
-
-
-async def snippet_to_embed(file_contents, file_path, start_line, end_line):
-    """Given file contents, file path, start line and end line creates a code block"""
+    return await snippet_to_embed(file_contents, file_path, start_line, end_line, max_chars)
+
+
+async def snippet_to_embed(file_contents, file_path, start_line, end_line, max_chars=None):
+    """
+    Given file contents (a str or Blob), file path, start line and end line creates a code block
+
+    If the code block would be longer than max_chars, lines are cut from its
+    end until it fits. Code blocks are memoized in render_cache, so popular
+    links are only rendered once
+    """
+
+    text = file_contents.text if isinstance(file_contents, Blob) else file_contents
+    # str caches its hash, so this is O(1) for file contents that come from the file cache
+    key = (hash(text), len(text), file_path, start_line, end_line, max_chars)
+    code_block = render_cache.get(key)
+    if code_block is None:
+        with span('render', start_line=start_line, end_line=end_line):
+            indexed = isinstance(file_contents, Blob) and file_contents.starts is not None
+            if len(text) > RENDER_EXECUTOR_CHARS and not indexed:
+                # Blobs build their line index a chunk at a time, letting the loop run in between
+                if not isinstance(file_contents, Blob):
+                    file_contents = Blob(file_contents)
+                code_block = await asyncio.get_event_loop().run_in_executor(
+                    render_executor, render_snippet, file_contents, file_path, start_line, end_line, max_chars)
+            else:
+                code_block = render_snippet(file_contents, file_path, start_line, end_line, max_chars)
+        render_cache.set(key, code_block)
+    return code_block
+
+
+def render_snippet(file_contents, file_path, start_line, end_line, max_chars=None):
+    """
+    Renders the code block for snippet_to_embed
+
+    Lines of a Blob are found with its line index, so only the linked lines are split
+    """
+
+    if isinstance(file_contents, Blob):
+        line_count = file_contents.line_count()
+        line_range = file_contents.line_range
+    else:
+        split_file_contents = file_contents.splitlines()
+        line_count = len(split_file_contents)
 
-    split_file_contents = file_contents.splitlines()
+        def line_range(start_line, end_line):
+            return split_file_contents[start_line - 1:end_line]
 
     if start_line is None:
-        start_line, end_line = 1, len(split_file_contents)
+        start_line, end_line = 1, line_count
     elif end_line is None:
         start_line = end_line = int(start_line)
     else:
@@ -140,19 +681,60 @@ async def snippet_to_embed(file_contents, file_path, start_line, end_line):
 
     if start_line > end_line:
         start_line, end_line = end_line, start_line
-    if start_line > len(split_file_contents) or end_line < 1:
+    if start_line > line_count or end_line < 1:
         return ''
 
     start_line = max(1, start_line)
-    end_line = min(len(split_file_contents), end_line)
-
-    required = '\n'.join(split_file_contents[start_line - 1:end_line])
-    required = textwrap.dedent(required).rstrip().replace('`', '`\u200b')
+    end_line = min(line_count, end_line)
 
     language = file_path.split('/')[-1].split('.')[-1]
     if not language.replace('-', '').replace('+', '').replace('_', '').isalnum():
         language = ''
 
+    code_block = format_snippet(file_path, language, start_line, end_line, line_range(start_line, end_line))
+    if max_chars is None:
+        return code_block
+
+    # Cut lines from the end until it fits. Dedenting depends on which lines
+    # are kept, so each attempt is rendered from scratch
+    while len(code_block) > max_chars and end_line > start_line:
+        end_line = start_line + (end_line - start_line) * max_chars // len(code_block)
+        code_block = format_snippet(file_path, language, start_line, end_line, line_range(start_line, end_line))
+    return code_block if len(code_block) <= max_chars else ''
+
+
+def dedent_lines(lines):
+    """
+    Returns textwrap.dedent('\\n'.join(lines)), finding and removing the
+    indentation the lines share in one pass over them instead of several
+    regex scans of the joined text
+
+    As with textwrap.dedent, lines of only spaces and tabs become empty and
+    don't count towards the shared indentation
+    """
+
+    indents = []
+    kept = []
+    for line in lines:
+        content = line.lstrip(' \t')
+        if content:
+            indents.append(line[:len(line) - len(content)])
+            kept.append(line)
+        else:
+            kept.append('')
+
+    # commonprefix only compares the lowest and highest indents in sort order
+    margin = len(commonprefix(indents))
+    if margin:
+        kept = [line[margin:] for line in kept]
+    return '\n'.join(kept)
+
+
+def format_snippet(file_path, language, start_line, end_line, lines):
+    """Formats lines start_line to end_line of a file as a code block with a header"""
+
+    required = dedent_lines(lines).rstrip().replace('`', '`\u200b')
+
     if start_line == end_line:
         ret = f'`{file_path}` line {start_line}\n'
     else:
@@ -162,21 +744,79 @@ async def snippet_to_embed(file_contents, file_path, start_line, end_line):
     return f'{ret}``` ```\n'
 
 
-async def wait_for_deletion(message, bot, message_to_send, embed=False):
-    if embed:
-        sent_message = await message.channel.send(embed=message_to_send)
-    else:
-        sent_message = await message.channel.send(message_to_send)
-    if message.guild is not None:
-        await message.edit(suppress=True)
-    await sent_message.add_reaction('🗑️')
+async def send_reply(channel, message_to_send, embed=False):
+    with span('send'):
+        if embed:
+            return await channel.send(embed=message_to_send)
+        return await channel.send(message_to_send)
+
+
+async def suppress_embeds(message):
+    """
+    Suppresses a message's embeds, unless another cog already has
+
+    Does nothing outside guilds, where the bot can't edit others' messages
+    """
+
+    if message.guild is None or message.id in suppressed_messages:
+        return
 
-    def check(reaction, user):
-        return user == message.author and str(reaction.emoji) == '🗑️'
+    async def suppress():
+        # Remembered before the edit is sent, so a reply that fails while it's
+        # in flight knows to undo it
+        suppressed_messages.set(message.id, 0, size=1)
+        with span('suppress_embeds'):
+            try:
+                await message.edit(suppress=True)
+            except discord.HTTPException:
+                # Most likely missing the Manage Messages permission, which shouldn't stop the reply
+                log.warning('Failed to suppress embeds on %s', message.id)
+
+    await flights.do(('suppress', message.id), suppress)
+
+
+async def restore_embeds(message):
+    """
+    Undoes suppress_embeds, if it got as far as editing the message and no
+    other reply to the message was sent
+    """
+
+    if suppressed_messages.get(message.id) != 0:
+        return
+    suppressed_messages.pop(message.id)
 
     try:
-        await bot.wait_for('reaction_add', timeout=10.0, check=check)
-    except asyncio.TimeoutError:
-        await sent_message.remove_reaction('🗑️', bot.user)
-    else:
-        await sent_message.delete()
+        await message.edit(suppress=False)
+    except discord.HTTPException:
+        log.warning('Failed to restore embeds on %s', message.id)
+
+
+async def wait_for_deletion(message, bot, message_to_send, embed=False):
+    """
+    Replies to message, suppressing its embeds, and lets its author delete
+    the reply by reacting with 🗑️
+    """
+
+    with reply_seconds.time():
+        # Sending and editing are separate routes in Discord's rate limits,
+        # so the embeds are suppressed while the reply is being sent
+        suppressing = asyncio.ensure_future(suppress_embeds(message))
+        try:
+            sent_message = await send_reply(message.channel, message_to_send, embed)
+        except Exception:
+            # Without a reply, the link shouldn't lose its preview either
+            suppressing.cancel()
+            await asyncio.gather(suppressing, return_exceptions=True)
+            await restore_embeds(message)
+            raise
+        await suppressing
+
+        if message.guild is not None:
+            if message.id not in suppressed_messages:
+                # Another reply to the message failed and restored its embeds while this one was sent
+                await suppress_embeds(message)
+            suppressed_messages.set(message.id, suppressed_messages.get(message.id, 0) + 1, size=1)
+
+        bot.get_cog('DeleteReactions').watch(sent_message, message.author.id)
+        with span('add_reaction'):
+            await sent_message.add_reaction(DELETE_EMOJI)
@@ -0,0 +1,125 @@
+"""
+Runs Git the lines as several worker processes
+
+Each worker runs bot.py with a contiguous range of the bot's shards, so
+matching and rendering snippets is spread over more than one CPU. The
+launcher also runs the coordinator that shares the GitHub and GitLab rate
+limits between the workers, and points them all at the same disk cache
+
+Run with `python launcher.py --workers 4`
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+import aiohttp
+
+from cogs.coordinator import Coordinator
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+
+# Workers that exit are restarted after this many seconds, doubling each time they exit again quickly
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+
+log = logging.getLogger('launcher')
+
+
+async def recommended_shards(token):
+    """Asks Discord how many shards the bot should have"""
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            'https://discord.com/api/v10/gateway/bot', headers={'Authorization': f'Bot {token}'}
+        ) as response:
+            response.raise_for_status()
+            return (await response.json())['shards']
+
+
+def shard_ranges(shard_count, workers):
+    """Splits the shard IDs into workers contiguous ranges of nearly equal size"""
+
+    return [range(i * shard_count // workers, (i + 1) * shard_count // workers) for i in range(workers)]
+
+
+def worker_env(worker, shards, shard_count, coordinator_port):
+    """Returns the environment variables a worker runs with"""
+
+    env = dict(os.environ)
+    env.update({
+        'WORKER_ID': str(worker),
+        'SHARD_COUNT': str(shard_count),
+        'SHARD_IDS': ','.join(map(str, shards)),
+        'COORDINATOR_PORT': str(coordinator_port),
+        # Every worker reads and writes the same cache, so a file fetched by one is cached for all
+        'DISK_CACHE_PATH': os.environ.get('DISK_CACHE_PATH', 'cache.sqlite3'),
+    })
+    # These have to differ between workers, so they're numbered from the configured value
+    if 'METRICS_PORT' in os.environ:
+        env['METRICS_PORT'] = str(int(os.environ['METRICS_PORT']) + worker)
+    if 'TRACE_FILE' in os.environ:
+        root, extension = os.path.splitext(os.environ['TRACE_FILE'])
+        env['TRACE_FILE'] = f'{root}-{worker}{extension}'
+    return env
+
+
+async def run_worker(worker, env, stopping):
+    """Runs a worker process, restarting it whenever it exits until stopping is set"""
+
+    delay = RESTART_DELAY
+    while not stopping.is_set():
+        log.info('Starting worker %s with shards %s', worker, env['SHARD_IDS'])
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        process = await asyncio.create_subprocess_exec(sys.executable, BOT_PATH, env=env)
+
+        stop = asyncio.ensure_future(stopping.wait())
+        await asyncio.wait([stop, asyncio.ensure_future(process.wait())], return_when=asyncio.FIRST_COMPLETED)
+        if stopping.is_set():
+            if process.returncode is None:
+                process.terminate()
+                await process.wait()
+            return
+        stop.cancel()
+
+        # Back off if the worker keeps crashing on startup
+        delay = RESTART_DELAY if loop.time() - started > MAX_RESTART_DELAY else min(delay * 2, MAX_RESTART_DELAY)
+        log.warning('Worker %s exited with code %s, restarting in %ss', worker, process.returncode, delay)
+        await asyncio.sleep(delay)
+
+
+async def main(args):
+    logging.basicConfig(level=logging.INFO)
+
+    shard_count = args.shards or await recommended_shards(os.environ['DISCORD_TOKEN'])
+    workers = min(args.workers, shard_count)
+    log.info('Running %s shards over %s workers', shard_count, workers)
+
+    server = await Coordinator(workers).start(port=args.coordinator_port)
+
+    stopping = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_event_loop().add_signal_handler(signum, stopping.set)
+
+    try:
+        await asyncio.gather(*(
+            run_worker(worker, worker_env(worker, shards, shard_count, args.coordinator_port), stopping)
+            for worker, shards in enumerate(shard_ranges(shard_count, workers))
+        ))
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('SHARD_COUNT', 0)),
+                        help="number of shards (default Discord's recommendation)")
+    parser.add_argument('--coordinator-port', type=int, default=int(os.environ.get('COORDINATOR_PORT', 8766)))
+
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,29 @@
+import asyncio
+import logging
+import socket
+from argparse import Namespace
+
+from benchmarks import bench_snippets
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_bench_snippets(caplog):
+    """Tests that the benchmark runs against the mock, and every provider's links get replies"""
+
+    args = Namespace(
+        messages=20, links_per_message=3, concurrency=10, latency=0, lines=100, rate_limit=5000, port=free_port())
+    messages = bench_snippets.make_messages(args.messages, args.links_per_message, args.lines)
+    for prefix in ['github.com', 'gitlab.com', 'bitbucket.org', 'foss.heptapod.net', 'gist.github.com']:
+        assert any(f'https://{prefix}/' in message for message in messages)
+
+    with caplog.at_level(logging.WARNING):
+        results = asyncio.run(bench_snippets.run(args))
+
+    assert not [record.getMessage() for record in caplog.records if record.name == 'cogs.code_snippets']
+    assert results['replies'] == results['messages'] == 20
+    assert results['rate_limited'] == 0
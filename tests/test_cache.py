@@ -0,0 +1,85 @@
+import time
+
+from cogs import cache
+from cogs.cache import Blob, LRUCache, is_commit_sha
+
+
+def test_lru_eviction():
+    """Tests that the least recently used entries are evicted first"""
+
+    cache = LRUCache(max_bytes=10, ttl=60)
+    cache.set('a', 'aaaa')
+    cache.set('b', 'bbbb')
+    assert cache.get('a') == 'aaaa'
+
+    cache.set('c', 'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'aaaa'
+    assert cache.get('c') == 'cccc'
+    assert cache.total_bytes == 8
+    assert cache.stats()['evictions'] == 1
+
+    # Entries bigger than the whole cache are never stored
+    cache.set('d', 'd' * 11)
+    assert cache.get('d') is None
+    assert len(cache) == 2
+
+
+def test_ttl():
+    """Tests that entries expire, and that immutable entries live longer"""
+
+    cache = LRUCache(max_bytes=100, ttl=0.05, immutable_ttl=60)
+    cache.set('mutable', 'x')
+    cache.set('immutable', 'y', immutable=True)
+    time.sleep(0.1)
+
+    assert cache.get('mutable') is None
+    assert cache.get('immutable') == 'y'
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_is_commit_sha():
+    """Tests detection of immutable refs"""
+
+    assert is_commit_sha('197308c293b64151ef6ac1b7238051ed415a181b')
+    assert not is_commit_sha('master')
+    assert not is_commit_sha('197308c')
+    assert not is_commit_sha(None)
+
+
+def test_lookup_stale():
+    """Tests that expired entries can still be looked up for revalidation"""
+
+    cache = LRUCache(max_bytes=100, ttl=0.05)
+    cache.set('a', 'x')
+    assert cache.lookup('a') == ('x', True)
+
+    time.sleep(0.1)
+    assert cache.lookup('a') == ('x', False)
+    assert cache.lookup('b') == (None, False)
+
+    cache.set('a', 'x')
+    assert cache.lookup('a') == ('x', True)
+
+
+def test_blob_line_index():
+    """Tests that line ranges from the line index match splitlines()"""
+
+    for text in ['', 'a', 'a\n', 'a\nb', 'a\r\nb\rc\x0cd\n\n', '\n\nx\n']:
+        blob = Blob(text)
+        lines = text.splitlines()
+        assert blob.line_count() == len(lines)
+        for start_line in range(1, len(lines) + 2):
+            for end_line in range(start_line, len(lines) + 2):
+                assert blob.line_range(start_line, end_line) == lines[start_line - 1:end_line]
+
+
+def test_blob_line_index_chunks(monkeypatch):
+    """Tests that building the line index in chunks finds the same lines, even with \r\n at chunk ends"""
+
+    monkeypatch.setattr(cache, 'INDEX_CHUNK', 2)
+    text = 'ab\r\ncd\r\n\r\ne\rf\x85gh\n\nij'
+    blob = Blob(text)
+    assert blob.line_count() == len(text.splitlines())
+    assert blob.line_range(1, blob.line_count()) == text.splitlines()
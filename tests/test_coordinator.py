@@ -0,0 +1,68 @@
+import asyncio
+import time
+
+from cogs.coordinator import Coordinator, budget_reports, sync_budgets
+from cogs.ratelimit import Scheduler
+
+
+def test_shares_by_demand():
+    """Tests that workers get shares of the rate in proportion to their demand"""
+
+    coordinator = Coordinator(workers=2)
+    coordinator.report(0, {'api.github.com/anonymous': {'demand': 9}})
+    reply = coordinator.report(1, {'api.github.com/anonymous': {'demand': 0}})
+
+    assert reply['budgets']['api.github.com/anonymous']['share'] == 1 / 11
+    reply = coordinator.report(0, {'api.github.com/anonymous': {'demand': 9}})
+    assert reply['budgets']['api.github.com/anonymous']['share'] == 10 / 11
+
+    # Demand counts the requests sent and shed since the last report, not ever
+    scheduler = Scheduler(rate=10, burst=10, max_wait=5, max_queue=10)
+    budget = scheduler.budget('https://api.github.com/', None)
+    last_counts = {}
+    budget.sent, budget.shed = 3, 6
+    assert budget_reports(scheduler, last_counts)['api.github.com/anonymous']['demand'] == 9
+    budget.sent += 1
+    reports = budget_reports(scheduler, last_counts)
+    assert reports['api.github.com/anonymous']['demand'] == 1
+
+    coordinator.report(1, {'api.github.com/anonymous': {'demand': 9}})
+    reply = coordinator.report(0, reports)
+    assert reply['budgets']['api.github.com/anonymous']['share'] == 2 / 12
+
+
+def test_guild_totals():
+    """Tests that the total guilds are only reported once every worker has reported its own"""
+
+    coordinator = Coordinator(workers=2)
+    assert coordinator.report(0, {}, guilds=10)['guilds'] is None
+    assert coordinator.report(1, {}, guilds=None)['guilds'] is None
+    assert coordinator.report(1, {}, guilds=5)['guilds'] == 15
+    assert coordinator.report(0, {}, guilds=12)['guilds'] == 17
+
+
+def test_shares_quota():
+    """Tests that workers share quotas and rates through the coordinator"""
+
+    async def run():
+        server = await Coordinator(workers=2).start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        schedulers = [Scheduler(rate=10, burst=10, max_wait=5, max_queue=10) for _ in range(2)]
+        budgets = [scheduler.budget('https://api.github.com/', None) for scheduler in schedulers]
+        budgets[0].update({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) + 60)}, 403)
+
+        syncs = [
+            asyncio.ensure_future(sync_budgets(scheduler, worker, port=port, interval=0.01))
+            for worker, scheduler in enumerate(schedulers)
+        ]
+        await asyncio.sleep(0.1)
+        for sync in syncs:
+            sync.cancel()
+        server.close()
+        await server.wait_closed()
+        return budgets
+
+    budgets = asyncio.run(run())
+    assert budgets[1].remaining == 0
+    assert budgets[1].delay() > 50
+    assert budgets[0].max_rate + budgets[1].max_rate <= 10
@@ -0,0 +1,130 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from cogs.delete_reactions import DELETE_EMOJI, DeleteReactions
+from cogs.utils import wait_for_deletion
+
+
+class FakeReply:
+    def __init__(self, message_id):
+        self.id = message_id
+        self.deleted = False
+        self.reactions = {DELETE_EMOJI}
+
+    async def delete(self):
+        self.deleted = True
+
+    async def add_reaction(self, emoji):
+        self.reactions.add(emoji)
+
+    async def remove_reaction(self, emoji, member):
+        self.reactions.discard(emoji)
+
+
+def reaction(message_id, user_id, emoji=DELETE_EMOJI):
+    return SimpleNamespace(message_id=message_id, user_id=user_id, emoji=emoji)
+
+
+def test_delete_and_expire():
+    """Tests that only the link's author can delete a reply, and only until it expires"""
+
+    async def run():
+        cog = DeleteReactions(SimpleNamespace(user=None))
+        cog.timeout = 0.05
+        replies = [FakeReply(1), FakeReply(2)]
+        for reply in replies:
+            cog.watch(reply, author_id=10)
+
+        await cog.on_raw_reaction_add(reaction(1, user_id=11))
+        await cog.on_raw_reaction_add(reaction(1, user_id=10, emoji='👍'))
+        assert not replies[0].deleted
+        await cog.on_raw_reaction_add(reaction(1, user_id=10))
+
+        await asyncio.sleep(0.1)
+        await cog.on_raw_reaction_add(reaction(2, user_id=10))
+        return cog, replies
+
+    cog, replies = asyncio.run(run())
+    assert replies[0].deleted
+    assert not replies[1].deleted
+    assert not replies[1].reactions
+    assert not cog.watched and not cog.expiry
+
+
+def test_max_watched():
+    """Tests that the oldest replies stop being watched past the limit"""
+
+    async def run():
+        cog = DeleteReactions(SimpleNamespace(user=None))
+        cog.max_watched = 2
+        replies = [FakeReply(message_id) for message_id in range(3)]
+        for reply in replies:
+            cog.watch(reply, author_id=10)
+        await asyncio.sleep(0)
+        cog.cog_unload()
+        return cog, replies
+
+    cog, replies = asyncio.run(run())
+    assert list(cog.watched) == [1, 2]
+    assert not replies[0].reactions
+
+
+class FakeMessage:
+    def __init__(self, message_id, send_error=None):
+        self.id = message_id
+        self.guild = SimpleNamespace(id=1)
+        self.author = SimpleNamespace(id=10)
+        self.channel = SimpleNamespace(send=self.send)
+        self.send_error = send_error
+        self.edits = []
+
+    async def send(self, content):
+        await asyncio.sleep(0.01)
+        if self.send_error is not None:
+            raise self.send_error
+        return FakeReply(self.id + 1)
+
+    async def edit(self, suppress):
+        self.edits.append(suppress)
+
+
+def reply(message):
+    """Replies to message with wait_for_deletion"""
+
+    async def run():
+        cog = DeleteReactions(SimpleNamespace(user=None))
+        bot = SimpleNamespace(get_cog=lambda name: cog)
+        try:
+            await wait_for_deletion(message, bot, 'snippet')
+        finally:
+            cog.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_failed_reply_keeps_embeds():
+    """Tests that a link's embeds are suppressed when replied to, and restored if the reply fails"""
+
+    message = FakeMessage(100)
+    reply(message)
+    assert message.edits == [True]
+
+    message = FakeMessage(200, send_error=discord.HTTPException(
+        SimpleNamespace(status=403, reason='Forbidden'), 'Missing Permissions'))
+    with pytest.raises(discord.HTTPException):
+        reply(message)
+    assert message.edits == [True, False]
+
+
+def test_earlier_reply_keeps_suppression():
+    """Tests that a failed reply doesn't restore the embeds of a link that already got a reply"""
+
+    message = FakeMessage(300)
+    reply(message)
+    message.send_error = discord.HTTPException(SimpleNamespace(status=500, reason='Server Error'), 'Oops')
+    with pytest.raises(discord.HTTPException):
+        reply(message)
+    assert message.edits == [True]
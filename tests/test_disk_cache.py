@@ -0,0 +1,52 @@
+import asyncio
+import random
+
+from cogs.cache import Blob
+from cogs.disk_cache import DiskCache
+
+
+def test_round_trip(tmp_path):
+    """Tests that blobs and their validators survive reopening the cache"""
+
+    async def run():
+        cache = DiskCache(str(tmp_path / 'cache.db'), max_bytes=1024 * 1024)
+        await cache.set(('github.com', 'a/b', 'master', 'README.md'), Blob('# Hi\n', True, '"etag"'), 60)
+        cache.close()
+
+        cache = DiskCache(str(tmp_path / 'cache.db'), max_bytes=1024 * 1024)
+        blob, ttl = await cache.get(('github.com', 'a/b', 'master', 'README.md'))
+        missing, _ = await cache.get(('github.com', 'a/b', 'master', 'bot.py'))
+        cache.close()
+        return blob, ttl, missing
+
+    blob, ttl, missing = asyncio.run(run())
+    assert blob.text == '# Hi\n'
+    assert blob.complete
+    assert blob.etag == '"etag"'
+    assert 0 < ttl <= 60
+    assert missing is None
+
+
+def test_eviction_and_hottest(tmp_path):
+    """Tests that the least recently used blobs are evicted and the most used come back first"""
+
+    rng = random.Random(0)
+
+    def text():
+        # Random text doesn't compress, so each blob takes up about 400 bytes
+        return ''.join(chr(rng.randrange(33, 127)) for _ in range(400))
+
+    async def run():
+        cache = DiskCache(str(tmp_path / 'cache.db'), max_bytes=1000)
+        await cache.set(('a',), Blob(text()), 60)
+        await cache.set(('b',), Blob(text()), 60)
+        await cache.get(('b',))
+        await cache.set(('c',), Blob(text()), 60)
+        hottest = await cache.hottest(10)
+        stats = cache.stats()
+        cache.close()
+        return hottest, stats
+
+    hottest, stats = asyncio.run(run())
+    assert [key for key, _, _, _ in hottest] == [('b',), ('c',)]
+    assert stats['evictions'] == 1
@@ -0,0 +1,227 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiohttp
+import pytest
+
+from benchmarks.mock_server import MockProviders, MockSession, start
+from cogs import utils
+from cogs.cache import LRUCache
+from cogs.utils import FileTooLarge, fetch_file, read_lines, read_range, transfer_stats
+from tests.test_bench_snippets import free_port
+
+URL = 'https://foss.heptapod.net/owner/repo/-/raw/branch/master/test.py'
+KEY = ('foss.heptapod.net', 'owner/repo', 'master', 'test.py')
+LAST_MODIFIED = 'Wed, 21 Oct 2015 07:28:00 GMT'
+
+
+def make_lines(lines, word='line'):
+    """Generates a file of 100 byte lines"""
+
+    return ''.join(f'{word} {i:<{94 - len(word)}}\n' for i in range(lines)).encode()
+
+
+@asynccontextmanager
+async def mock_session(providers):
+    """Serves providers, yielding a session that sends requests to them"""
+
+    port = free_port()
+    runner = await start(providers, port=port)
+    session = aiohttp.ClientSession()
+    try:
+        yield MockSession(session, f'http://127.0.0.1:{port}')
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+
+def fetch_range(providers, end_line):
+    async def run():
+        async with mock_session(providers) as session:
+            return await read_range(session, URL, end_line)
+
+    return asyncio.run(run())
+
+
+def fetch_lines(providers, end_line=None, **kwargs):
+    async def run():
+        async with mock_session(providers) as session:
+            async with session.get(URL) as response:
+                return await read_lines(response, end_line, **kwargs)
+
+    return asyncio.run(run())
+
+
+class NoTotalProviders(MockProviders):
+    """Leaves the file size out of Content-Range, so only a 416 shows where the file ends"""
+
+    def body(self, request, body, headers, **kwargs):
+        response = super().body(request, body, headers, **kwargs)
+        if 'Content-Range' in response.headers:
+            response.headers['Content-Range'] = response.headers['Content-Range'].rpartition('/')[0] + '/*'
+        return response
+
+
+class NoRangeProviders(MockProviders):
+    """Ignores Range, always sending the whole file"""
+
+    def body(self, request, body, headers, ranged=False, **kwargs):
+        return super().body(request, body, headers, **kwargs)
+
+
+class ChangingProviders(MockProviders):
+    """Serves a new version of every file after the first request"""
+
+    def file(self, path):
+        return make_lines(1000, 'old' if self.stats['requests'] == 1 else 'new')
+
+
+class ValidatorProviders(MockProviders):
+    """Sends Last-Modified as well as ETag, and remembers the validators each request sent"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.validators = []
+
+    async def handle(self, request):
+        self.validators.append((request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')))
+        return await super().handle(request)
+
+    def body(self, request, body, headers, **kwargs):
+        return super().body(request, body, dict(headers, **{'Last-Modified': LAST_MODIFIED}), **kwargs)
+
+
+def test_range_doubles():
+    """Tests that the range doubles until it has line end_line"""
+
+    providers = MockProviders(latency=0)
+    providers.files['test.py'] = contents = make_lines(1000)
+
+    # 600 lines estimated at 64 bytes each is 384 of these lines, so it takes two requests
+    blob = fetch_range(providers, 600)
+    assert providers.stats['requests'] == 2
+    assert providers.stats['bytes'] == 2 * 600 * 64
+    assert not blob.complete
+    assert blob.lines >= 600
+    assert contents.decode().startswith(blob.text)
+
+
+def test_range_stops_at_total():
+    """Tests that a range covering the Content-Range total reads the whole file in one request"""
+
+    providers = MockProviders(latency=0)
+    providers.files['test.py'] = contents = make_lines(300)
+
+    blob = fetch_range(providers, 500)
+    assert providers.stats['requests'] == 1
+    assert blob.complete
+    assert blob.text == contents.decode()
+
+
+def test_range_416_at_end():
+    """Tests that a 416 after a range ending exactly at the end of the file completes it"""
+
+    providers = NoTotalProviders(latency=0)
+    providers.files['test.py'] = contents = make_lines(384)
+
+    blob = fetch_range(providers, 600)
+    assert providers.stats['requests'] == 2
+    assert blob.complete
+    assert blob.text == contents.decode()
+
+
+def test_range_ignored():
+    """Tests falling back to streaming the whole response when the server ignores Range"""
+
+    providers = NoRangeProviders(latency=0)
+    providers.files['test.py'] = contents = make_lines(300)
+
+    blob = fetch_range(providers, 100)
+    assert providers.stats['requests'] == 1
+    assert blob.lines >= 100
+    assert contents.decode().startswith(blob.text)
+
+    blob = fetch_range(providers, 500)
+    assert blob.complete
+    assert blob.text == contents.decode()
+
+
+def test_range_file_changed():
+    """Tests that a file changing between ranges is read again rather than joined across versions"""
+
+    # If-Range gets the whole new version in the second response
+    providers = ChangingProviders(latency=0)
+    blob = fetch_range(providers, 600)
+    assert providers.stats['requests'] == 2
+    assert blob.lines >= 600
+    assert blob.text.startswith('new') and 'old' not in blob.text
+
+    # Without If-Range, the mismatched ETag starts a full read
+    providers = ChangingProviders(latency=0)
+    providers.if_range = False
+    blob = fetch_range(providers, 600)
+    assert providers.stats['requests'] == 3
+    assert blob.lines >= 600
+    assert blob.text.startswith('new') and 'old' not in blob.text
+
+
+def test_lines_stop_early():
+    """Tests that reading stops soon after line end_line, keeping the prefix read so far"""
+
+    providers = MockProviders(latency=0)
+    providers.files['test.py'] = contents = make_lines(50000)
+
+    start_bytes = transfer_stats['bytes']
+    blob = fetch_lines(providers, 10)
+    assert not blob.complete
+    assert blob.lines >= 10
+    assert contents.decode().startswith(blob.text)
+    assert transfer_stats['bytes'] - start_bytes < len(contents) // 10
+
+    blob = fetch_lines(providers)
+    assert blob.complete
+    assert blob.text == contents.decode()
+
+
+def test_lines_too_large():
+    """Tests that files are never read past max_bytes"""
+
+    providers = MockProviders(latency=0)
+    providers.files['test.py'] = make_lines(100)
+
+    with pytest.raises(FileTooLarge):
+        fetch_lines(providers, max_bytes=5000)
+    # Lines before max_bytes are fine
+    assert fetch_lines(providers, 10, max_bytes=5000).lines >= 10
+
+
+@pytest.mark.parametrize('ranged', [True, False])
+def test_revalidation(monkeypatch, ranged):
+    """Tests that stale files are revalidated, and a 304 serves and refreshes the cached Blob"""
+
+    cache = LRUCache(max_bytes=1024 * 1024, ttl=0)
+    monkeypatch.setattr(utils, 'file_cache', cache)
+    monkeypatch.setattr(utils, 'disk_cache', None)
+    providers = ValidatorProviders(latency=0)
+    providers.files['test.py'] = make_lines(300)
+
+    async def run():
+        async with mock_session(providers) as session:
+            first = await fetch_file(session, KEY, URL, 10, ranged=ranged)
+            assert providers.validators == [(None, None)]
+            assert cache.lookup(KEY) == (first, False)
+
+            revalidated = transfer_stats['revalidated']
+            cache.ttl = 300
+            second = await fetch_file(session, KEY, URL, 10, ranged=ranged)
+            assert second is first
+            assert providers.validators[1] == (first.etag, LAST_MODIFIED)
+            assert providers.stats['not_modified'] == 1
+            assert transfer_stats['revalidated'] == revalidated + 1
+            assert cache.lookup(KEY) == (first, True)
+
+            # Now it's fresh, so it's served without a request
+            assert await fetch_file(session, KEY, URL, 10, ranged=ranged) is first
+            assert len(providers.validators) == 2
+
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+
+from benchmarks import mock_server
+from benchmarks.mock_server import MockProviders
+from cogs import utils
+from cogs.cache import LRUCache
+from cogs.utils import fetch_github_gist_snippet, gist_files
+from tests.test_downloads import mock_session
+
+
+def fetch_gist(monkeypatch, providers, links):
+    """Fetches each (revision, start line, end line) of a gist from the mock, with empty caches"""
+
+    monkeypatch.setattr(utils, 'gist_cache', LRUCache(max_bytes=1024 * 1024, ttl=300))
+    monkeypatch.setattr(utils, 'file_cache', LRUCache(max_bytes=1024 * 1024, ttl=300))
+    monkeypatch.setattr(utils, 'disk_cache', None)
+
+    async def run():
+        async with mock_session(providers) as session:
+            return [
+                await fetch_github_gist_snippet(session, 'abc', revision, 'test-py', start_line, end_line)
+                for revision, start_line, end_line in links
+            ]
+
+    return asyncio.run(run())
+
+
+def test_gist_files():
+    """Tests that only untruncated files keep their contents, and the first file wins a slug"""
+
+    files = gist_files({'files': {
+        'A.py': {'raw_url': 'https://a', 'truncated': False, 'content': 'a\n'},
+        'a.py': {'raw_url': 'https://b', 'truncated': False, 'content': 'b\n'},
+        'big.txt': {'raw_url': 'https://c', 'truncated': True, 'content': 'c'},
+    }})
+
+    assert list(files) == ['a-py', 'big-txt']
+    name, raw_url, contents = files['a-py']
+    assert (name, raw_url, contents.text) == ('A.py', 'https://a', 'a\n')
+    assert files['big-txt'] == ('big.txt', 'https://c', None)
+
+
+def test_inline_content(monkeypatch):
+    """Tests that untruncated gists are rendered without fetching the raw file"""
+
+    providers = MockProviders(latency=0)
+    snippet, = fetch_gist(monkeypatch, providers, [('', 1, 3)])
+
+    assert 'value_0 = ' in snippet and 'value_2 = ' in snippet
+    assert providers.stats['requests'] == 1
+
+
+def test_truncated_content(monkeypatch):
+    """Tests that truncated gists fall back to the raw file"""
+
+    monkeypatch.setattr(mock_server, 'GIST_INLINE_LIMIT', 1000)
+    providers = MockProviders(latency=0)
+    snippet, = fetch_gist(monkeypatch, providers, [('', 100, 102)])
+
+    assert 'value_99 = ' in snippet and 'value_101 = ' in snippet
+    assert providers.stats['requests'] == 2
+
+
+def test_cached_revision(monkeypatch):
+    """Tests that a gist is fetched once per revision, then served from the gist cache"""
+
+    providers = MockProviders(latency=0)
+    snippets = fetch_gist(monkeypatch, providers, [('a' * 40, 1, 3), ('a' * 40, 5, 6), ('b' * 40, 1, 3)])
+
+    assert 'value_5 = ' in snippets[1]
+    assert providers.stats['requests'] == 2
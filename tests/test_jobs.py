@@ -0,0 +1,48 @@
+import asyncio
+
+from cogs.jobs import REJECT, JobQueue
+
+
+def test_guild_fairness():
+    """Tests that workers take jobs from each guild in turn"""
+
+    async def run():
+        queue = JobQueue(workers=1, max_size=10)
+        order = []
+
+        async def job(name):
+            order.append(name)
+            return name
+
+        results = await asyncio.gather(*(
+            queue.run(guild, lambda name=name: job(name))
+            for guild, name in [('a', 'a1'), ('a', 'a2'), ('a', 'a3'), ('b', 'b1')]
+        ))
+        queue.close()
+        return order, results
+
+    order, results = asyncio.run(run())
+    assert order == ['a1', 'b1', 'a2', 'a3']
+    assert results == ['a1', 'a2', 'a3', 'b1']
+
+
+def test_full_queue():
+    """Tests that a full queue drops the busiest guild's oldest job, or rejects new ones"""
+
+    async def run(policy):
+        queue = JobQueue(workers=1, max_size=2, policy=policy)
+        done = []
+
+        async def job(name):
+            done.append(name)
+            return name
+
+        results = await asyncio.gather(*(
+            queue.run(guild, lambda name=name: job(name))
+            for guild, name in [('a', 'a1'), ('a', 'a2'), ('b', 'b1')]
+        ))
+        queue.close()
+        return results
+
+    assert asyncio.run(run('drop_oldest')) == [None, 'a2', 'b1']
+    assert asyncio.run(run(REJECT)) == ['a1', 'a2', None]
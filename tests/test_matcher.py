@@ -0,0 +1,110 @@
+import asyncio
+
+from cogs import code_snippets
+from cogs.code_snippets import CodeSnippets
+from cogs.utils import fetch_github_snippet, fetch_gitlab_snippet, snippet_to_embed
+
+
+def test_combined_matcher():
+    """Tests that the combined regex dispatches each link to its provider, in order"""
+
+    matcher = CodeSnippets(None, None).matcher
+
+    matches = list(matcher.finditer(
+        'see https://gitlab.com/dolphingarlic/bot-testing/-/blob/master/nested/file.py#L1-2 and '
+        'https://github.com/dolphingarlic/git-the-lines/blob/master/bot.py#L1-L2'
+    ))
+
+    assert [handler for handler, _, _ in matches] == [fetch_gitlab_snippet, fetch_github_snippet]
+    assert matches[0][1] == {
+        'repo': 'dolphingarlic/bot-testing',
+        'path': 'master/nested/file.py',
+        'start_line': '1',
+        'end_line': '2',
+    }
+    assert matches[1][1]['path'] == 'master/bot.py'
+
+
+def test_mixed_providers():
+    """Tests that a link without a line number doesn't swallow the links after it"""
+
+    matcher = CodeSnippets(None, None).matcher
+
+    matches = list(matcher.finditer(
+        'https://foss.heptapod.net/pypy/pypy/-/blob/branch/py3.7/include/PyPy.h and '
+        'https://github.com/a/b/blob/master/x.py#L1 then '
+        'https://bitbucket.org/a/b/src/master/y.py and https://gitlab.com/a/b/-/blob/master/z.py#L2-3'
+    ))
+
+    assert [(kwargs.get('path', kwargs.get('file_path')), kwargs['start_line']) for _, kwargs, _ in matches] == [
+        ('py3.7/include/PyPy.h', None), ('master/x.py', '1'), ('y.py', None), ('master/z.py', '2'),
+    ]
+
+
+def test_prefilter():
+    """Tests that messages without known links are skipped"""
+
+    matcher = CodeSnippets(None, None).matcher
+
+    assert not matcher.might_match('no links here')
+    assert not matcher.might_match('https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+    assert list(matcher.finditer('https://github.com/dolphingarlic')) == []
+
+
+def test_plan_snippets():
+    """Tests that links are fitted into one message's lines before anything is fetched"""
+
+    cog = CodeSnippets(None, None)
+    planned = cog.plan_snippets(cog.matcher.finditer(
+        'https://github.com/a/b/blob/master/whole.py '
+        'https://github.com/a/b/blob/master/long.py#L10-L40 '
+        'https://gitlab.com/a/b/-/blob/master/reversed.py#L9-3 '
+        'https://github.com/a/b/blob/master/huge.py#L1-L10000'
+    ))
+
+    assert [(kwargs['start_line'], kwargs['end_line']) for _, kwargs, _, _ in planned] == [(10, 40), (3, 9), (1, 6)]
+
+
+def test_whole_file_links_share_lines(monkeypatch):
+    """Tests that whole-file links share the lines left once their lengths are known"""
+
+    files = {
+        'master/Procfile': 'worker: python bot.py\n',
+        'master/nested/fi.l/e.py': 'print(1)\nprint(2)\n',
+        'master/long.py': ''.join(f'print({i})\n' for i in range(100)),
+    }
+
+    async def fetch_fake_snippet(session, repo, path, start_line, end_line, max_chars=None):
+        return await snippet_to_embed(files[path], path.split('/')[-1], start_line, end_line, max_chars)
+
+    async def wait_for_deletion(message, bot, message_to_send):
+        sent.append(message_to_send)
+
+    def reply(content):
+        cog = CodeSnippets(None, None)
+        planned = [
+            (fetch_fake_snippet, kwargs, link, whole_file)
+            for _, kwargs, link, whole_file in cog.plan_snippets(cog.matcher.finditer(content))
+        ]
+        asyncio.run(cog.send_snippets(None, planned, 0))
+        return sent.pop()
+
+    sent = []
+    monkeypatch.setattr(code_snippets, 'wait_for_deletion', wait_for_deletion)
+
+    assert reply(
+        'https://github.com/dolphingarlic/bot-testing/blob/master/Procfile '
+        'https://github.com/dolphingarlic/bot-testing/blob/master/nested/fi.l/e.py'
+    ) == (
+        '`Procfile` line 1\n```Procfile\nworker: python bot.py```\n'
+        '`e.py` lines 1 to 2\n```py\nprint(1)\nprint(2)```'
+    )
+
+    message = reply(
+        'https://github.com/a/b/blob/master/Procfile '
+        'https://github.com/a/b/blob/master/long.py '
+        'https://github.com/a/b/blob/master/nested/fi.l/e.py'
+    )
+    assert message.count('\n') + 1 == code_snippets.MAX_MESSAGE_LINES
+    assert '`long.py` lines 1 to 45\n' in message
+    assert 'e.py' not in message
@@ -0,0 +1,41 @@
+from cogs.metrics import Counter, Histogram, endpoint, metrics
+
+
+def test_histogram():
+    """Tests bucketing, quantiles and the text format of histograms"""
+
+    histogram = Histogram('test_seconds', 'Test histogram', buckets=(0.1, 1))
+    metrics.remove(histogram)
+    for value in [0.05, 0.05, 0.5, 5]:
+        histogram.observe(value, provider='github')
+
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1
+    assert histogram.quantile(1) == float('inf')
+
+    lines = list(histogram.render())
+    assert 'test_seconds_bucket{provider="github",le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{provider="github",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{provider="github"} 4' in lines
+
+
+def test_counter():
+    """Tests that counters are kept per set of labels"""
+
+    counter = Counter('test_total', 'Test counter')
+    metrics.remove(counter)
+    counter.inc(host='api.github.com', status=200)
+    counter.inc(host='api.github.com', status=200)
+    counter.inc(host='gitlab.com', status=404)
+
+    assert counter.total() == 3
+    assert 'test_total{host="api.github.com",status="200"} 2' in list(counter.render())
+
+
+def test_endpoint():
+    """Tests labelling API endpoints"""
+
+    assert endpoint('https://api.github.com/repos/a/b/branches?per_page=100') == 'branches'
+    assert endpoint('https://api.github.com/repos/a/b/contents/bot.py?ref=master') == 'contents'
+    assert endpoint('https://bitbucket.org/a/b/raw/c/d.py') == 'raw'
+    assert endpoint('https://api.github.com/repos/a/b') == 'other'
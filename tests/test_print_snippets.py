@@ -3,6 +3,7 @@ import discord.ext.test as dpytest
 import pytest
 
 from cogs.code_snippets import CodeSnippets
+from cogs.delete_reactions import DeleteReactions
 from discord.ext.commands import Bot
 
 
@@ -12,6 +13,7 @@ async def bot():
 
     async with aiohttp.ClientSession() as session:
         bot = Bot(command_prefix='.')
+        bot.add_cog(DeleteReactions(bot))
         bot.add_cog(CodeSnippets(bot, session))
 
         yield bot
@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import pytest
+
+from cogs.ratelimit import SNIPPET, WIDGET, Budget, RateLimitExceeded, Scheduler
+
+
+def test_priority_order():
+    """Tests that queued snippet requests go ahead of widget requests"""
+
+    async def run():
+        budget = Budget(rate=100, burst=1, max_wait=5, max_queue=10)
+        order = []
+
+        async def send(name, priority):
+            await budget.acquire(priority)
+            order.append(name)
+
+        await send('first', WIDGET)
+        await asyncio.gather(send('widget', WIDGET), send('snippet', SNIPPET))
+        return order
+
+    assert asyncio.run(run()) == ['first', 'snippet', 'widget']
+
+
+def test_shed_when_exhausted():
+    """Tests that requests are shed while the reported quota is used up"""
+
+    async def run():
+        budget = Budget(rate=100, burst=10, max_wait=5, max_queue=10)
+        budget.update({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) + 60)}, 403)
+        with pytest.raises(RateLimitExceeded):
+            await budget.acquire(SNIPPET)
+        return budget.stats()
+
+    stats = asyncio.run(run())
+    assert stats['remaining'] == 0
+    assert stats['shed'] == 1
+
+
+def test_full_quota_not_paced():
+    """Tests that a burst runs at the full rate while plenty of quota is left, and is paced once it runs low"""
+
+    async def run():
+        budget = Budget(rate=10, burst=20, max_wait=5, max_queue=100)
+        budget.update({'X-RateLimit-Remaining': '4999', 'X-RateLimit-Reset': str(int(time.time()) + 3600)}, 200)
+        assert budget.rate == 10
+
+        # 20 from the burst, then 20 more at 10 per second
+        start_time = time.perf_counter()
+        await asyncio.gather(*(budget.acquire(SNIPPET) for _ in range(40)))
+        elapsed = time.perf_counter() - start_time
+
+        budget.update({'X-RateLimit-Remaining': '500', 'X-RateLimit-Reset': str(int(time.time()) + 3600)}, 200)
+        return budget, elapsed
+
+    budget, elapsed = asyncio.run(run())
+    assert budget.shed == 0
+    assert elapsed < 3
+    assert budget.rate == pytest.approx(500 / 3600, rel=0.01)
+
+
+def test_budgets_per_host_and_token():
+    """Tests that only API hosts are rate limited, with one budget per token"""
+
+    scheduler = Scheduler(rate=10, burst=20, max_wait=5, max_queue=10)
+
+    assert scheduler.budget('https://bitbucket.org/a/b/raw/c/d', {}) is None
+    anonymous = scheduler.budget('https://api.github.com/repos/a/b', {})
+    authorized = scheduler.budget('https://api.github.com/repos/a/b', {'Authorization': 'token secret'})
+    assert anonymous is not authorized
+    assert anonymous is scheduler.budget('https://api.github.com/gists/c', None)
+    assert not any('secret' in key for key in scheduler.stats())
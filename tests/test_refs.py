@@ -0,0 +1,24 @@
+from cogs.refs import RefTrie
+
+
+def test_longest_prefix():
+    """Tests splitting paths on refs, including refs with slashes"""
+
+    refs = RefTrie(['master', 'feature', 'feature/x', 'release/1.0'])
+
+    assert refs.split('master/bot.py') == ('master', 'bot.py')
+    assert refs.split('feature/x/cogs/utils.py') == ('feature/x', 'cogs/utils.py')
+    assert refs.split('feature/y/cogs/utils.py') == ('feature', 'y/cogs/utils.py')
+    assert refs.split('release/1.0/README.md') == ('release/1.0', 'README.md')
+
+
+def test_unknown_ref():
+    """Tests falling back to the first segment when no ref matches"""
+
+    refs = RefTrie(['master'])
+
+    assert refs.longest_prefix('0127ff78/README.md') is None
+    assert refs.split('0127ff78/nested/file.py') == ('0127ff78', 'nested/file.py')
+
+    # The file path can't be empty
+    assert refs.longest_prefix('master') is None
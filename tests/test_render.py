@@ -0,0 +1,20 @@
+import random
+import textwrap
+
+from cogs.utils import dedent_lines
+
+
+def test_dedent_lines():
+    """Tests that dedent_lines matches textwrap.dedent, including tabs and whitespace-only lines"""
+
+    assert dedent_lines(['    a', '', '      b', '  ', '    c']) == 'a\n\n  b\n\nc'
+    assert dedent_lines(['\t a', '\t\tb']) == ' a\n\tb'
+    assert dedent_lines(['  ', ' ']) == '\n'
+
+    rng = random.Random(0)
+    for _ in range(1000):
+        lines = [
+            ''.join(rng.choice(' \tx') for _ in range(rng.randrange(6)))
+            for _ in range(rng.randrange(1, 6))
+        ]
+        assert dedent_lines(lines) == textwrap.dedent('\n'.join(lines))
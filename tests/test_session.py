@@ -0,0 +1,44 @@
+import asyncio
+
+from aiohttp import web
+
+from cogs import metrics
+from cogs.session import connection_stats, create_session, pool_metrics
+
+
+def test_pool_metrics():
+    """Tests that the session's pool usage and connection reuse are exported as metrics"""
+
+    async def ok(request):
+        return web.Response(text='ok')
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/', ok)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', 0).start()
+        port = runner.addresses[0][1]
+
+        try:
+            async with create_session() as session:
+                for _ in range(3):
+                    async with session.get(f'http://127.0.0.1:{port}/') as response:
+                        await response.text()
+
+                metrics.collector(lambda: pool_metrics(session))
+                try:
+                    return port, metrics.render().splitlines()
+                finally:
+                    metrics.collectors.pop()
+        finally:
+            await runner.cleanup()
+
+    reused = connection_stats['reused']
+    port, lines = asyncio.run(run())
+    # One connection, opened once and then reused for the other two requests
+    assert connection_stats['reused'] - reused == 2
+    assert f'gitthelines_http_connections_opened{{kind="reused"}} {connection_stats["reused"]}' in lines
+    assert 'gitthelines_http_connections{state="in_use"} 0' in lines
+    assert f'gitthelines_http_host_connections{{host="127.0.0.1:{port}",state="idle"}} 1' in lines
+    assert 'gitthelines_http_connection_limit{scope="per_host"} 20' in lines
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from cogs.singleflight import SingleFlight
+
+
+def test_shared_call():
+    """Tests that concurrent callers with the same key share one call"""
+
+    async def run():
+        flights = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'contents'
+
+        results = await asyncio.gather(*(flights.do('url', fetch) for _ in range(5)))
+        return results, calls, flights
+
+    results, calls, flights = asyncio.run(run())
+    assert results == ['contents'] * 5
+    assert len(calls) == 1
+    assert len(flights) == 0
+    assert flights.stats()['shared'] == 4
+
+
+def test_cancelled_waiter():
+    """Tests that cancelling one waiter doesn't cancel the shared call"""
+
+    async def run():
+        flights = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return 'contents'
+
+        first = asyncio.ensure_future(flights.do('url', fetch))
+        second = asyncio.ensure_future(flights.do('url', fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == 'contents'
+
+
+def test_all_waiters_cancelled():
+    """Tests that the shared call is cancelled once nobody is waiting on it"""
+
+    async def run():
+        flights = SingleFlight()
+        finished = []
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            finished.append(1)
+
+        waiter = asyncio.ensure_future(flights.do('url', fetch))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.1)
+        return finished, flights
+
+    finished, flights = asyncio.run(run())
+    assert finished == []
+    assert len(flights) == 0
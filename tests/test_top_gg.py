@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+from cogs import top_gg
+from cogs.coordinator import cluster_stats
+
+
+class FakeResponse:
+    def raise_for_status(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeSession:
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, json, headers):
+        self.posts.append((url, json))
+        return FakeResponse()
+
+
+class FakeBot:
+    guilds = [1, 2, 3]
+    user = SimpleNamespace(id=42)
+
+    async def wait_until_ready(self):
+        pass
+
+    def is_closed(self):
+        return False
+
+    def dispatch(self, event):
+        pass
+
+
+def test_posts_cluster_total(monkeypatch):
+    """Tests that the server count posted is the process's own, or the total over every worker under launcher.py"""
+
+    monkeypatch.setenv('TOP_GG_TOKEN', 'token')
+    monkeypatch.setattr(top_gg, 'RETRY_INTERVAL', 0.01)
+
+    async def run():
+        session = FakeSession()
+        cog = top_gg.TopGG(FakeBot(), session)
+        await asyncio.sleep(0.05)
+        cog.cog_unload()
+        return session.posts
+
+    monkeypatch.delenv('COORDINATOR_PORT', raising=False)
+    assert asyncio.run(run()) == [('https://top.gg/api/bots/42/stats', {'server_count': 3})]
+
+    monkeypatch.setenv('COORDINATOR_PORT', '8766')
+    monkeypatch.setitem(cluster_stats, 'guilds', None)
+    assert asyncio.run(run()) == []
+    monkeypatch.setitem(cluster_stats, 'guilds', 40)
+    assert asyncio.run(run()) == [('https://top.gg/api/bots/42/stats', {'server_count': 40})]
@@ -0,0 +1,51 @@
+import asyncio
+
+from cogs.tracing import recent_traces, slowest_traces, span, trace
+
+
+def test_spans_across_tasks():
+    """Tests that spans in tasks started inside a trace are recorded to it"""
+
+    async def fetch(link, delay):
+        with span('fetch', link=link):
+            await asyncio.sleep(delay)
+            with span('render'):
+                pass
+
+    async def handle():
+        with trace('on_message', sample_rate=1, guild=1) as current:
+            with span('match'):
+                pass
+            await asyncio.gather(fetch('a', 0.02), fetch('b', 0.01))
+        return current
+
+    current = asyncio.run(handle())
+
+    assert current in recent_traces
+    assert [recorded[0] for recorded in current.spans] == ['match', 'fetch', 'fetch', 'render', 'render']
+    assert [recorded[2] for recorded in current.spans] == [0, 0, 0, 1, 1]
+    assert current.duration >= 0.02
+    assert 'link=a' in current.format()
+
+
+def test_unsampled():
+    """Tests that spans outside a sampled trace aren't recorded anywhere"""
+
+    recent_traces.clear()
+    with trace('on_message', sample_rate=0) as current:
+        with span('match') as labels:
+            labels['links'] = 1
+
+    assert current is None
+    assert not recent_traces
+
+
+def test_slowest_traces():
+    """Tests that the slowest traces are returned first"""
+
+    recent_traces.clear()
+    for delay in [0.01, 0.03, 0.02]:
+        with trace('on_message', sample_rate=1, delay=delay):
+            asyncio.run(asyncio.sleep(delay))
+
+    assert [slow.labels['delay'] for slow in slowest_traces(2)] == [0.03, 0.02]
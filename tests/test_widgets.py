@@ -0,0 +1,63 @@
+import pytest
+
+from cogs import commit_widgets, pull_request_widgets, repo_widgets
+from cogs.commit_widgets import CommitWidgets, github_commit
+from cogs.pull_request_widgets import PullRequestWidgets
+from cogs.repo_widgets import RepoWidgets
+from cogs.utils import pick
+
+
+def test_pick():
+    """Tests that pick copies only the given fields, keeping nested nulls"""
+
+    value = {'a': 1, 'b': {'c': 2, 'd': 3}, 'e': None, 'f': 4}
+    assert pick(value, {'a': None, 'b': {'c': None}, 'e': {'g': None}}) == {'a': 1, 'b': {'c': 2}, 'e': None}
+
+    with pytest.raises(KeyError):
+        pick(value, {'missing': None})
+
+
+def test_github_commit():
+    """Tests that cached commits count their files instead of keeping the diffs"""
+
+    commit = {
+        'sha': 'a' * 40, 'html_url': 'https://github.com/o/r/commit/' + 'a' * 40, 'node_id': 'x',
+        'stats': {'additions': 1, 'deletions': 2, 'total': 3},
+        'commit': {'message': 'Fix', 'author': {'date': '2020-01-01T00:00:00Z', 'name': 'o'}},
+        'author': None,
+        'files': [{'filename': 'a.py', 'patch': '+' * 10000}, {'filename': 'b.py', 'patch': ''}],
+    }
+    summary = github_commit(commit)
+    assert summary['files_changed'] == 2
+    assert 'files' not in summary and 'node_id' not in summary
+    assert summary['author'] is None
+    assert summary['commit'] == {'message': 'Fix', 'author': {'date': '2020-01-01T00:00:00Z'}}
+
+
+def test_widget_links():
+    """Tests that each widget cog's regexes match only their own kind of link, stopping at whitespace"""
+
+    content = (
+        'https://github.com/a/b/pull/3 https://gitlab.com/c/d https://github.com/a/b '
+        'https://github.com/a/b/commit/' + 'f' * 40 + ' https://gitlab.com/c/d/-/commit/abc '
+        'https://github.com/a/b/blob/master/x.py#L1'
+    )
+
+    assert [m.groupdict() for m in repo_widgets.GITHUB_RE.finditer(content)] == [{'owner': 'a', 'repo': 'b'}]
+    assert [m.groupdict() for m in repo_widgets.GITLAB_RE.finditer(content)] == [{'owner': 'c', 'repo': 'd'}]
+    # The owner can't run on past a space into the next word
+    assert repo_widgets.GITHUB_RE.search('see https://github.com/a and/b') is None
+    assert [m.groupdict() for m in commit_widgets.GITHUB_RE.finditer(content)] == [
+        {'owner': 'a', 'repo': 'b', 'commit': 'f' * 40},
+    ]
+    assert [m.groupdict() for m in commit_widgets.GITLAB_RE.finditer(content)] == [
+        {'owner': 'c', 'repo': 'd', 'commit': 'abc'},
+    ]
+    assert [m.groupdict() for m in pull_request_widgets.GITHUB_RE.finditer(content)] == [
+        {'owner': 'a', 'repo': 'b', 'pr': '3'},
+    ]
+
+    for cog in [RepoWidgets(None, None), CommitWidgets(None, None), PullRequestWidgets(None, None)]:
+        assert cog.matcher.might_match(content)
+        assert not cog.matcher.might_match('no links here')
+        assert not cog.matcher.might_match('https://example.com/a/b')